@@ -0,0 +1,88 @@
+import argparse
+import multiprocessing
+import sys
+import time
+import computer
+from perft import newGameState
+
+DEPTH = 3
+workerSearch = None  # In a worker: its own Search, its transposition table kept from one task to the next
+
+
+def initWorker():
+    global workerSearch
+    workerSearch = computer.Search()
+
+
+def evaluateFEN(fen, depth=DEPTH, timeLimit=None, search=None):
+    """(fen, SearchResult) of a search of the FEN position, or (fen, None) if the FEN can't be read or
+    describes a position the move generators can't play. The result of a finished game has no bestMove and
+    scores the final position. The root moves are shuffled from the position's own seed, so without a timeLimit
+    the result depends only on the FEN, the depth and what search's transposition table already holds."""
+    search = search if search is not None else workerSearch if workerSearch is not None else computer.Search()
+    try:
+        gs = newGameState(fen, True)
+        validMoves = gs.getValidMoves()
+        if not validMoves:
+            return fen, computer.SearchResult(score=computer.scoreBoard(gs))
+        search.random.seed(gs.zobristKey)
+        return fen, search.run(gs, validMoves, depth, timeLimit)
+    except (ValueError, KeyError, IndexError):
+        return fen, None
+
+
+def evaluateTask(task):
+    fen, depth, timeLimit = task
+    return evaluateFEN(fen, depth, timeLimit)
+
+
+def evaluateGame(fens, depth=DEPTH, timeLimit=None, search=None):
+    """The SearchResult (or None) of every position of a game, searched in order from a cleared transposition
+    table, so later positions reuse what earlier ones found and the results don't depend on other games"""
+    search = search if search is not None else workerSearch if workerSearch is not None else computer.Search()
+    search.transpositionTable.clear()
+    return [evaluateFEN(fen, depth, timeLimit, search)[1] for fen in fens]
+
+
+def evaluateGameTask(task):
+    fens, depth, timeLimit = task
+    return evaluateGame(fens, depth, timeLimit)
+
+
+def evaluatePositions(fens, depth=DEPTH, timeLimit=None, workers=1, chunkSize=4):
+    """Yields (fen, SearchResult) for every FEN of fens (any iterable, read as results are needed) in the
+    same order. Scores are from white's point of view in pawns; an unreadable FEN gives None. With workers
+    above 1 the positions are searched in a process pool, each worker with its own transposition table."""
+    if workers <= 1:
+        search = computer.Search()
+        for fen in fens:
+            yield evaluateFEN(fen, depth, timeLimit, search)
+        return
+    with multiprocessing.Pool(workers, initializer=initWorker) as pool:
+        yield from pool.imap(evaluateTask, ((fen, depth, timeLimit) for fen in fens), chunkSize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate every FEN of a file (one per line) and print the best move")
+    parser.add_argument("path", help="file of FEN strings, - for stdin")
+    parser.add_argument("--depth", type=int, default=DEPTH, help="search depth in plies")
+    parser.add_argument("--time", type=float, default=None, help="seconds per position")
+    parser.add_argument("--workers", type=int, default=1, help="processes to search in")
+    args = parser.parse_args(argv)
+    f = sys.stdin if args.path == "-" else open(args.path)
+    fens = (line.strip() for line in f if line.strip() and not line.startswith("#"))
+    startTime, positions = time.perf_counter(), 0
+    for fen, result in evaluatePositions(fens, args.depth, args.time, args.workers):
+        positions += 1
+        if result is None:
+            print(f"{fen}: invalid FEN")
+            continue
+        bestMove = result.bestMove.getChessNotation() if result.bestMove is not None else "none"
+        print(f"{fen}: {result.score:+.2f} {bestMove} depth {result.depth} nodes {result.nodes}", flush=True)
+    elapsed = time.perf_counter() - startTime
+    print(f"{positions} positions in {elapsed:.1f}s ({positions / max(elapsed, 1e-9):.1f} positions/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
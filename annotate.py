@@ -0,0 +1,178 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import analysis
+import computer
+from computer import CHECKMATE
+from pgn import readGames, replayGame, moveToSan, formatGame, PgnError
+from perft import START_FEN, newGameState
+
+DEPTH = 3
+BATCH_GAMES = 32  # Games evaluated between checkpoints
+EVAL_CAP = 10  # Scores are capped at this many pawns before measuring how much a move lost, so won positions stay won
+# Score a move loses against the evaluation before it, in pawns, to be flagged, with the NAG it gets
+JUDGEMENTS = [(2.0, "$4", "Blunder"), (1.0, "$2", "Mistake"), (0.5, "$6", "Inaccuracy")]
+
+
+def checkpointPath(outputPath):
+    return outputPath + ".checkpoint"
+
+
+def loadCheckpoint(outputPath, inputPath):
+    """(games done, output size) saved by the last interrupted run on the same input, or (0, 0)"""
+    try:
+        with open(checkpointPath(outputPath)) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if checkpoint.get("input") != os.path.abspath(inputPath):
+        return 0, 0
+    return checkpoint["games"], checkpoint["outputBytes"]
+
+
+def saveCheckpoint(outputPath, inputPath, games, outputBytes):
+    """Written to a temporary file and renamed, so an interruption never leaves half a checkpoint"""
+    path = checkpointPath(outputPath)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"input": os.path.abspath(inputPath), "games": games, "outputBytes": outputBytes}, f)
+    os.replace(path + ".tmp", path)
+
+
+def formatEval(result):
+    """[%eval] comment of a SearchResult: pawns from white's point of view, or #N for a forced mate"""
+    if abs(result.score) >= CHECKMATE:
+        moves = (len(result.pv) + 1) // 2
+        return f"[%eval #{moves if result.score > 0 else -moves}]"
+    return f"[%eval {result.score:.2f}]"
+
+
+def cappedScore(score, mover):
+    """score from the point of view of mover (1 white, -1 black), capped at EVAL_CAP pawns either way"""
+    return max(-EVAL_CAP, min(EVAL_CAP, score * mover))
+
+
+def gamePositions(headers, sanMoves):
+    """FEN of every position of a game, the final one included, with the moves played; raises PgnError"""
+    gs, moves = replayGame(headers, sanMoves)
+    fens = [gs.getFEN()]
+    for _ in moves:
+        gs.undoMove()
+        fens.append(gs.getFEN())
+    fens.reverse()
+    return fens, moves
+
+
+def annotateGame(headers, moves, results, depth):
+    """PGN text of a game with the evaluation after every move and a NAG and the better move on every move
+    that loses at least the smallest of JUDGEMENTS. results holds the SearchResult of every position, None where
+    the search failed: a move gets no comment without the result after it, and no judgement without both."""
+    gs = newGameState(headers.get("FEN", START_FEN), True)
+    blackToMoveFirst, firstMoveNumber = not gs.whiteToMove, gs.startPly // 2 + 1
+    sanMoves, annotations = [], []
+    for i, (move, choice) in enumerate(moves):
+        validMoves = gs.getValidMoves()
+        before, after = results[i], results[i + 1]
+        sanMoves.append(moveToSan(gs, move, validMoves, choice))
+        annotation = []
+        # No eval after the mating move
+        if after is not None and (after.bestMove is not None or abs(after.score) < CHECKMATE):
+            mover = 1 if gs.whiteToMove else -1
+            loss = cappedScore(before.score, mover) - cappedScore(after.score, mover) if before is not None else 0
+            comment = formatEval(after)
+            for threshold, nag, name in JUDGEMENTS:
+                if loss >= threshold and before.bestMove is not None and before.bestMove != move:
+                    bestMove = next(valid for valid in validMoves if valid == before.bestMove)
+                    annotation.append(nag)
+                    comment += f" {name}. {moveToSan(gs, bestMove, validMoves)} was best."
+                    break
+            annotation.append("{" + comment + "}")
+        annotations.append(annotation)
+        gs.makeMove(move, choice)
+    headers = dict(headers)
+    headers["Annotator"] = f"PyChessGame depth {depth}"
+    return formatGame(headers, sanMoves, headers.get("Result", "*"), firstMoveNumber, blackToMoveFirst, annotations)
+
+
+def annotateFile(inputPath, outputPath, depth=DEPTH, timeLimit=None, workers=1, batchGames=BATCH_GAMES):
+    """Annotates every game of inputPath into outputPath in the original order. batchGames games at a time are
+    searched across a process pool, a game per task (with timeLimit seconds a position, or to depth), then the
+    games are written and a checkpoint saved next to the output. Run again after an interruption and it carries
+    on from the last checkpoint. Games that can't be replayed are left out. Returns (games written, skipped)."""
+    done, outputBytes = loadCheckpoint(outputPath, inputPath)
+    if done and os.path.exists(outputPath):
+        print(f"resuming after game {done}")
+        output = open(outputPath, "r+", encoding="utf-8")
+        output.seek(outputBytes)
+    else:
+        done, output = 0, open(outputPath, "w", encoding="utf-8")
+    output.truncate()  # Drop whatever was written after the last checkpoint
+    pool = multiprocessing.Pool(workers, initializer=analysis.initWorker) if workers > 1 else None
+    search = computer.Search()
+    written, skipped, positions = 0, 0, 0
+    startTime = time.perf_counter()
+    try:
+        with open(inputPath, encoding="utf-8", errors="replace") as f:
+            games = readGames(f)
+            for _ in range(done):  # Already annotated, only the PGN text is read
+                next(games, None)
+            while True:
+                batch = []
+                for headers, sanMoves, result in games:
+                    try:
+                        fens, moves = gamePositions(headers, sanMoves)
+                    except PgnError as error:
+                        print(f"skipped game {done + len(batch) + 1}: {error}", file=sys.stderr)
+                        fens, moves = None, None
+                    batch.append((headers, fens, moves))
+                    if len(batch) == batchGames:
+                        break
+                if not batch:
+                    break
+                tasks = [(fens, depth, timeLimit) for _, fens, _ in batch if fens is not None]
+                if pool is not None:
+                    results = iter(pool.map(analysis.evaluateGameTask, tasks, chunksize=1))
+                else:
+                    results = iter([analysis.evaluateGame(fens, depth, timeLimit, search) for fens, _, _ in tasks])
+                for headers, fens, moves in batch:
+                    if fens is None:
+                        skipped += 1
+                        continue
+                    output.write(annotateGame(headers, moves, next(results), depth))
+                    written += 1
+                positions += sum(len(fens) for fens, _, _ in tasks)
+                done += len(batch)
+                output.flush()
+                os.fsync(output.fileno())
+                saveCheckpoint(outputPath, inputPath, done, output.tell())
+                elapsed = time.perf_counter() - startTime
+                print(f"{done} games done, {positions / max(elapsed, 1e-9):.1f} positions/s", flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        output.close()
+    if os.path.exists(checkpointPath(outputPath)):
+        os.remove(checkpointPath(outputPath))  # Finished, a new run starts over
+    return written, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate the games of a PGN file with engine evaluations")
+    parser.add_argument("input", help="PGN file to annotate")
+    parser.add_argument("output", help="annotated PGN file, resumed if a checkpoint from an earlier run is next to it")
+    parser.add_argument("--depth", type=int, default=DEPTH, help="search depth per position")
+    parser.add_argument("--time", type=float, default=None, help="seconds per position, the search stops at --depth "
+                                                                 "or when this runs out")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes to search in")
+    parser.add_argument("--batch", type=int, default=BATCH_GAMES, help="games between checkpoints")
+    args = parser.parse_args(argv)
+    written, skipped = annotateFile(args.input, args.output, args.depth, args.time, args.workers, args.batch)
+    print(f"{written} games annotated, {skipped} skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,593 @@
+from engine import GameState
+from moves import Move, CastleRights, PIECE_CODES, PIECE_NAMES, ENPASSANT_FLAG, CASTLE_FLAG, PROMOTION_FLAG
+import zobrist
+
+# Squares are numbered row * 8 + col, so square 0 is a8 and square 63 is h1 (same layout as GameState.board)
+PIECES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+SQUARE_BITS = [1 << sq for sq in range(64)]
+FULL_BOARD = (1 << 64) - 1
+RANK_1, RANK_8 = 0xFF << 56, 0xFF
+RANK_3, RANK_6 = 0xFF << 40, 0xFF << 16
+FILE_A = sum(SQUARE_BITS[r * 8] for r in range(8))
+NOT_FILE_A, NOT_FILE_H = FULL_BOARD ^ FILE_A, FULL_BOARD ^ (FILE_A << 7)
+
+# Ray directions as (row, column) steps. Directions that increase the square index scan with the lowest set bit,
+# the others with the highest one
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+POSITIVE_DIRECTIONS = {(1, 0), (0, 1), (1, -1), (1, 1)}
+
+# Each colour's pieces in PIECES order, and the ones that can be captured with their Move piece codes
+COLOR_PIECES = {color: tuple(color + pieceType for pieceType in "pNBRQK") for color in "wb"}
+CAPTURE_CODES = {color: tuple((piece, PIECE_CODES[piece]) for piece in COLOR_PIECES[color][:5]) for color in "wb"}
+PROMOTION_PIECES = {'R': 'R', 'B': 'B', 'N': 'N'}  # Any other choice promotes to a queen, as in GameState
+NEW_MOVE = Move.__new__  # Moves are built straight from their packed integer, without reading a board
+
+
+def _stepTargets(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in steps:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                mask |= SQUARE_BITS[(r + dr) * 8 + c + dc]
+        table.append(mask)
+    return table
+
+
+def _rays():
+    rays = {}
+    for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+        table = []
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            mask = 0
+            r, c = r + d[0], c + d[1]
+            while 0 <= r < 8 and 0 <= c < 8:
+                mask |= SQUARE_BITS[r * 8 + c]
+                r, c = r + d[0], c + d[1]
+            table.append(mask)
+        rays[d] = table
+    return rays
+
+
+KNIGHT_ATTACKS = _stepTargets(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _stepTargets(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# Squares a pawn of the given colour attacks from each square
+PAWN_ATTACKS = {"w": _stepTargets(((-1, -1), (-1, 1))), "b": _stepTargets(((1, -1), (1, 1)))}
+RAYS = _rays()
+
+# BETWEEN[a][b] holds the squares strictly between a and b when they share a rank, file or diagonal
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _a in range(64):
+    for _d, _table in RAYS.items():
+        _ray = _table[_a]
+        _b = _ray
+        while _b:
+            _bit = _b & -_b
+            _sq = _bit.bit_length() - 1
+            BETWEEN[_a][_sq] = _ray & ~_table[_sq] & ~_bit
+            _b ^= _bit
+
+
+def squares(bitboard):
+    """Yields the index of every set bit, lowest first"""
+    while bitboard:
+        bit = bitboard & -bitboard
+        yield bit.bit_length() - 1
+        bitboard ^= bit
+
+
+def directionFrom(fromSq, toSq):
+    """(row, column) step from one square towards another, the raw offset if they are not on a line"""
+    dr, dc = toSq // 8 - fromSq // 8, toSq % 8 - fromSq % 8
+    if dr == 0 or dc == 0 or abs(dr) == abs(dc):
+        return (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)
+    return dr, dc
+
+
+def rayAttacks(sq, occupied, directions):
+    """Squares reached from sq along the given directions, stopping at (and including) the first blocker"""
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if d in POSITIVE_DIRECTIONS:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[d][first]
+        attacks |= ray
+    return attacks
+
+
+def _lineTables(directions):
+    """For every square, the squares that can block it along two opposite directions (the last square of each
+    ray never blocks anything) and a dict from their occupancy to the squares attacked along that line"""
+    masks, tables = [], []
+    for sq in range(64):
+        mask = 0
+        for d in directions:
+            ray = RAYS[d][sq]
+            edge = (1 << (ray.bit_length() - 1)) if d in POSITIVE_DIRECTIONS and ray else ray & -ray
+            mask |= ray ^ edge
+        table, subset = {}, 0
+        while True:  # Every subset of mask, by the carry-rippler trick
+            table[subset] = rayAttacks(sq, subset, directions)
+            subset = (subset - mask) & mask
+            if not subset:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+# Slider attacks are two dict lookups per piece instead of walking four rays
+RANK_MASKS, RANK_TABLES = _lineTables(((0, -1), (0, 1)))
+FILE_MASKS, FILE_TABLES = _lineTables(((-1, 0), (1, 0)))
+DIAGONAL_MASKS, DIAGONAL_TABLES = _lineTables(((-1, -1), (1, 1)))
+ANTIDIAGONAL_MASKS, ANTIDIAGONAL_TABLES = _lineTables(((-1, 1), (1, -1)))
+
+
+def rookAttacks(sq, occupied):
+    return RANK_TABLES[sq][occupied & RANK_MASKS[sq]] | FILE_TABLES[sq][occupied & FILE_MASKS[sq]]
+
+
+def bishopAttacks(sq, occupied):
+    return DIAGONAL_TABLES[sq][occupied & DIAGONAL_MASKS[sq]] | \
+        ANTIDIAGONAL_TABLES[sq][occupied & ANTIDIAGONAL_MASKS[sq]]
+
+
+def addMoves(moves, base, targets, enemy, pieceBitboards, captureCodes):
+    """Appends a Move from base (start square and piece code) to every square of targets, reading what is
+    captured on the enemy ones from the bitboards"""
+    captures = targets & enemy
+    targets ^= captures
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        move = NEW_MOVE(Move)
+        move.packed = base | (bit.bit_length() - 1) << 6
+        moves.append(move)
+    while captures:
+        bit = captures & -captures
+        captures ^= bit
+        for piece, code in captureCodes:
+            if pieceBitboards[piece] & bit:
+                break
+        move = NEW_MOVE(Move)
+        move.packed = base | (bit.bit_length() - 1) << 6 | code << 16
+        moves.append(move)
+
+
+def addPawnMoves(moves, targets, delta, base, promotionRank, pieceBitboards, captureCodes):
+    """Appends the pawn moves landing on targets, each from the square delta away from where it lands"""
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        endSq = bit.bit_length() - 1
+        packed = base | (endSq + delta) | endSq << 6
+        if captureCodes is not None:
+            for piece, code in captureCodes:
+                if pieceBitboards[piece] & bit:
+                    packed |= code << 16
+                    break
+        if bit & promotionRank:
+            packed |= PROMOTION_FLAG
+        move = NEW_MOVE(Move)
+        move.packed = packed
+        moves.append(move)
+
+
+class BitboardGameState(GameState):
+    """GameState whose position lives in bitboards: one 64-bit set per piece plus per-colour and total occupancy.
+
+    makeMove and undoMove only touch the bitboards, and moves are built from them, so the 8x8 board is rebuilt
+    only when something reads it (the GUI, FEN export, the list generator). With verify=True every
+    getValidMoves call is checked against the list-of-strings generator and a mismatch raises an AssertionError.
+    """
+
+    def __init__(self, fen=None, verify=False):
+        super().__init__()
+        self.verify = verify
+        if fen is not None:
+            self.loadFEN(fen)
+        else:
+            self.refreshBitboards()
+
+    @property
+    def board(self):
+        """The 8x8 list of strings, rebuilt from the bitboards the first time it is read after a move"""
+        if self.boardStale:
+            board = [["--"] * 8 for _ in range(8)]
+            for piece, bitboard in self.pieceBitboards.items():
+                for sq in squares(bitboard):
+                    board[sq >> 3][sq & 7] = piece
+            self.boardView, self.boardStale = board, False
+        return self.boardView
+
+    @board.setter
+    def board(self, board):
+        self.boardView, self.boardStale = board, False
+
+    def loadFEN(self, fen):
+        super().loadFEN(fen)
+        self.refreshBitboards()
+
+    def refreshBitboards(self):
+        """Rebuilds every bitboard from self.board, needed after the board is edited directly"""
+        board = self.board
+        self.pieceBitboards = {piece: 0 for piece in PIECES}
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != "--":
+                    self.pieceBitboards[piece] |= SQUARE_BITS[r * 8 + c]
+        self.occupancy = {"w": 0, "b": 0}
+        for piece, bitboard in self.pieceBitboards.items():
+            self.occupancy[piece[0]] |= bitboard
+        self.occupied = self.occupancy["w"] | self.occupancy["b"]
+
+    def makeMove(self, move, choice='Q'):
+        packed = move.packed
+        pieceMoved = PIECE_NAMES[(packed >> 12) & 15]
+        placed = pieceMoved[0] + PROMOTION_PIECES.get(choice, 'Q') if packed & PROMOTION_FLAG else pieceMoved
+        rights = self.currentCastleRights
+        # Take out the castling rights and en passant file of the position we are leaving
+        self.zobristKey ^= zobrist.castleKey(rights) ^ self.enpassantKey()
+        self.updateBitboards(packed, placed)
+        self.moveLog.append((move, self.enpassantPossible, self.fiftyMoveCounter))
+        self.whiteToMove = not self.whiteToMove
+        startSq, endSq = packed & 63, (packed >> 6) & 63
+        if pieceMoved[1] == 'K':
+            if pieceMoved == "wK":
+                self.whiteKingLocation = (endSq >> 3, endSq & 7)
+            else:
+                self.blackKingLocation = (endSq >> 3, endSq & 7)
+        if pieceMoved[1] == 'p' and abs(endSq - startSq) == 16:  # Only on 2 square pawn advance
+            self.enpassantPossible = ((startSq + endSq) >> 4, startSq & 7)
+        else:
+            self.enpassantPossible = ()
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            self.updateCastleRights(move)
+        self.castleRightsLog.append(CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs))
+        if packed & 0xF0000 == 0 and pieceMoved[1] != 'p':  # Nothing captured and no pawn moved
+            self.fiftyMoveCounter += 1
+        else:
+            self.fiftyMoveCounter = 0
+        self.zobristKey ^= self.zobristMoveKey(move, placed) ^ zobrist.castleKey(rights) ^ self.enpassantKey()
+        self.keyHistory.append(self.zobristKey)
+        self.updateEvaluation(move, placed, 1)
+        self.boardStale = True
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1][0]
+            packed = move.packed
+            pieceMoved = placed = PIECE_NAMES[(packed >> 12) & 15]
+            if packed & PROMOTION_FLAG:  # Whichever piece stands on the promotion square
+                endBit = SQUARE_BITS[(packed >> 6) & 63]
+                for pieceType in "QRBN":
+                    if self.pieceBitboards[pieceMoved[0] + pieceType] & endBit:
+                        placed = pieceMoved[0] + pieceType
+                        break
+            self.updateEvaluation(move, placed, -1)
+            self.keyHistory.pop()
+            self.zobristKey ^= self.zobristMoveKey(move, placed) ^ \
+                zobrist.castleKey(self.currentCastleRights) ^ self.enpassantKey()
+            move, self.enpassantPossible, self.fiftyMoveCounter = self.moveLog.pop()
+            self.updateBitboards(packed, placed)
+            self.whiteToMove = not self.whiteToMove
+            if pieceMoved == "wK":
+                self.whiteKingLocation = ((packed >> 3) & 7, packed & 7)
+            elif pieceMoved == "bK":
+                self.blackKingLocation = ((packed >> 3) & 7, packed & 7)
+            self.castleRightsLog.pop()
+            castleRights = self.castleRightsLog[-1]
+            self.currentCastleRights = CastleRights(castleRights.wks, castleRights.bks, castleRights.wqs, castleRights.bqs)
+            self.checkmate, self.stalemate = False, False
+            self.zobristKey ^= zobrist.castleKey(self.currentCastleRights) ^ self.enpassantKey()
+            self.boardStale = True
+
+    def updateBitboards(self, packed, placed):
+        """Applies a packed move to the bitboards; applying it a second time takes it back since every update is
+        a XOR"""
+        pb, occupancy = self.pieceBitboards, self.occupancy
+        startBit, endBit = SQUARE_BITS[packed & 63], SQUARE_BITS[(packed >> 6) & 63]
+        pb[PIECE_NAMES[(packed >> 12) & 15]] ^= startBit
+        pb[placed] ^= endBit
+        color = placed[0]
+        occupancy[color] ^= startBit | endBit
+        capturedCode = (packed >> 16) & 15
+        if capturedCode:
+            captured = PIECE_NAMES[capturedCode]
+            if packed & ENPASSANT_FLAG:
+                capturedBit = SQUARE_BITS[(packed & 56) | ((packed >> 6) & 7)]  # Start row, end column
+            else:
+                capturedBit = endBit
+            pb[captured] ^= capturedBit
+            occupancy[captured[0]] ^= capturedBit
+        elif packed & CASTLE_FLAG:
+            if endBit > startBit:  # King side castle
+                rookBits = (endBit << 1) | (endBit >> 1)
+            else:  # Queen side castle
+                rookBits = (endBit >> 2) | (endBit << 1)
+            pb[color + 'R'] ^= rookBits
+            occupancy[color] ^= rookBits
+        self.occupied = occupancy["w"] | occupancy["b"]
+
+    def enpassantKey(self):
+        """zobrist.enpassantKey read from the bitboards: the file counts only if a pawn to move can capture there"""
+        if not self.enpassantPossible:
+            return 0
+        row, col = self.enpassantPossible
+        if self.whiteToMove:
+            capturers = PAWN_ATTACKS["b"][row * 8 + col] & self.pieceBitboards["wp"]
+        else:
+            capturers = PAWN_ATTACKS["w"][row * 8 + col] & self.pieceBitboards["bp"]
+        return zobrist.ENPASSANT_KEYS[col] if capturers else 0
+
+    def attackersTo(self, sq, color, occupied):
+        """Bitboard of the pieces of the given colour attacking sq, with sliders blocked by occupied"""
+        pb = self.pieceBitboards
+        pawn, knight, bishop, rook, queen, king = COLOR_PIECES[color]
+        enemy = 'b' if color == 'w' else 'w'
+        attackers = (KNIGHT_ATTACKS[sq] & pb[knight]) | (KING_ATTACKS[sq] & pb[king]) | \
+            (PAWN_ATTACKS[enemy][sq] & pb[pawn])  # Our pawn pattern from sq finds their pawns
+        rooks, bishops = pb[rook] | pb[queen], pb[bishop] | pb[queen]
+        if rooks:
+            attackers |= rookAttacks(sq, occupied) & rooks
+        if bishops:
+            attackers |= bishopAttacks(sq, occupied) & bishops
+        return attackers
+
+    def isAttacked(self, sq, color, occupied):
+        """Whether any piece of the given colour attacks sq, looking outward from sq and stopping at the first
+        attacker found"""
+        pb = self.pieceBitboards
+        pawn, knight, bishop, rook, queen, king = COLOR_PIECES[color]
+        if KNIGHT_ATTACKS[sq] & pb[knight] or KING_ATTACKS[sq] & pb[king] or \
+                PAWN_ATTACKS['b' if color == 'w' else 'w'][sq] & pb[pawn]:
+            return True
+        rooks, bishops = pb[rook] | pb[queen], pb[bishop] | pb[queen]
+        return bool((rooks and rookAttacks(sq, occupied) & rooks) or
+                    (bishops and bishopAttacks(sq, occupied) & bishops))
+
+    def attackedSquares(self, color, occupied):
+        """Every square attacked by the given colour"""
+        pb = self.pieceBitboards
+        attacked = 0
+        for sq in squares(pb[color + 'N']):
+            attacked |= KNIGHT_ATTACKS[sq]
+        for sq in squares(pb[color + 'K']):
+            attacked |= KING_ATTACKS[sq]
+        pawnAttacks = PAWN_ATTACKS[color]
+        for sq in squares(pb[color + 'p']):
+            attacked |= pawnAttacks[sq]
+        for sq in squares(pb[color + 'R'] | pb[color + 'Q']):
+            attacked |= rookAttacks(sq, occupied)
+        for sq in squares(pb[color + 'B'] | pb[color + 'Q']):
+            attacked |= bishopAttacks(sq, occupied)
+        return attacked
+
+    def pinnedPieces(self, kingSq, ally, opponent):
+        """Maps each pinned piece's square to the line it may still move along"""
+        pb = self.pieceBitboards
+        pins = {}
+        rookPinners = pb[opponent + 'R'] | pb[opponent + 'Q']
+        bishopPinners = pb[opponent + 'B'] | pb[opponent + 'Q']
+        pinners = 0
+        if rookPinners:
+            pinners |= rookAttacks(kingSq, self.occupancy[opponent]) & rookPinners
+        if bishopPinners:
+            pinners |= bishopAttacks(kingSq, self.occupancy[opponent]) & bishopPinners
+        for pinnerSq in squares(pinners):
+            blockers = BETWEEN[kingSq][pinnerSq] & self.occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & self.occupancy[ally]:
+                pins[blockers.bit_length() - 1] = BETWEEN[kingSq][pinnerSq] | SQUARE_BITS[pinnerSq]
+        return pins
+
+    def getValidMoves(self):
+        """Gets all legal moves using the bitboards"""
+        if self.verify:
+            legacyMoves = GameState.getValidMoves(self)
+        moves = self.generateMoves()
+
+        if self.verify:
+            self.compareMoveLists(moves, legacyMoves)
+
+        if len(moves) == 0:  # Either checkmate or stalemate
+            self.checkmate, self.stalemate = self.inCheck, not self.inCheck
+        else:
+            self.checkmate, self.stalemate = False, False
+
+        # Check for fifty-move rule
+        if self.fiftyMoveCounter >= 50:
+            self.stalemate = True
+
+        # Check for insufficient material
+        if self.insufficientMaterial():
+            self.stalemate = True
+
+        # Check for threefold repetition
+        if self.repetitionCount() >= 3:
+            self.stalemate = True
+
+        return moves
+
+    def hasLegalMove(self):
+        """True if the side to move has any legal move, stopping at the first one. Updates self.inCheck"""
+        return len(self.generateMoves(True)) > 0
+
+    def insufficientMaterial(self):
+        """Check for insufficient material to checkmate: bare kings, or one bishop or knight besides them"""
+        pb = self.pieceBitboards
+        others = self.occupied ^ pb["wK"] ^ pb["bK"]
+        return not others or (others & (others - 1) == 0 and
+                              others & (pb["wB"] | pb["wN"] | pb["bB"] | pb["bN"]) != 0)
+
+    def generateMoves(self, firstOnly=False):
+        """The legal moves of the side to move, the king's last. Sets inCheck, checks and pins. With firstOnly it
+        returns as soon as it has a move"""
+        pb = self.pieceBitboards
+        ally, opponent = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        pawn, knight, bishop, rook, queen, king = COLOR_PIECES[ally]
+        captureCodes = CAPTURE_CODES[opponent]
+        own, enemy, occupied = self.occupancy[ally], self.occupancy[opponent], self.occupied
+        kingBit = pb[king]
+        kingSq = kingBit.bit_length() - 1
+        moves = []
+
+        checkers = self.attackersTo(kingSq, opponent, occupied)
+        self.inCheck = checkers != 0
+        self.checks = [divmod(sq, 8) + directionFrom(kingSq, sq) for sq in squares(checkers)] if checkers else []
+        self.pins = {}
+
+        if checkers & (checkers - 1) == 0:  # Not in double check, other pieces may move
+            if checkers:
+                targetMask = (checkers | BETWEEN[kingSq][checkers.bit_length() - 1]) & ~own
+            else:
+                targetMask = FULL_BOARD & ~own
+            pins = self.pinnedPieces(kingSq, ally, opponent)
+            if pins:
+                self.pins = {divmod(sq, 8): directionFrom(kingSq, sq) for sq in pins}
+
+            pinnedPawns = 0
+            for sq in pins:
+                pinnedPawns |= SQUARE_BITS[sq] & pb[pawn]
+            self.getBitboardPawnMoves(moves, ally, pb[pawn] ^ pinnedPawns, pinnedPawns, kingSq, targetMask, pins)
+            if firstOnly and moves:
+                return moves
+
+            base = PIECE_CODES[knight] << 12
+            bitboard = pb[knight]
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                sq = bit.bit_length() - 1
+                if sq not in pins:  # A pinned knight can never move
+                    addMoves(moves, base | sq, KNIGHT_ATTACKS[sq] & targetMask, enemy, pb, captureCodes)
+            if firstOnly and moves:
+                return moves
+
+            for piece in (bishop, rook, queen):
+                base = PIECE_CODES[piece] << 12
+                bitboard = pb[piece]
+                while bitboard:
+                    bit = bitboard & -bitboard
+                    bitboard ^= bit
+                    sq = bit.bit_length() - 1
+                    if piece == bishop:
+                        targets = bishopAttacks(sq, occupied)
+                    elif piece == rook:
+                        targets = rookAttacks(sq, occupied)
+                    else:
+                        targets = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+                    targets &= targetMask
+                    if sq in pins:
+                        targets &= pins[sq]
+                    addMoves(moves, base | sq, targets, enemy, pb, captureCodes)
+                if firstOnly and moves:
+                    return moves
+
+        # The king is taken off the board so it cannot hide behind itself on a checking ray
+        withoutKing = occupied ^ kingBit
+        base = PIECE_CODES[king] << 12 | kingSq
+        targets = KING_ATTACKS[kingSq] & ~own
+        safe = 0
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if not self.isAttacked(bit.bit_length() - 1, opponent, withoutKing):
+                safe |= bit
+        addMoves(moves, base, safe, enemy, pb, captureCodes)
+        if not checkers and not (firstOnly and moves):
+            self.getBitboardCastleMoves(moves, ally, kingSq, base)
+        return moves
+
+    def getBitboardPawnMoves(self, moves, ally, pawns, pinnedPawns, kingSq, targetMask, pins):
+        """Pushes and captures of the unpinned pawns a whole set at a time, then the pinned ones and en passant
+        square by square"""
+        pb = self.pieceBitboards
+        opponent = 'b' if ally == 'w' else 'w'
+        captureCodes = CAPTURE_CODES[opponent]
+        empty = ~self.occupied & FULL_BOARD
+        enemy = self.occupancy[opponent]
+        base = PIECE_CODES[ally + 'p'] << 12
+        if ally == 'w':
+            single = (pawns >> 8) & empty
+            double = ((single & RANK_3) >> 8) & empty
+            left, right = ((pawns & NOT_FILE_A) >> 9) & enemy, ((pawns & NOT_FILE_H) >> 7) & enemy
+            step, deltas, promotionRank, doubleRank = -8, (8, 16, 9, 7), RANK_8, RANK_3
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & RANK_6) << 8) & empty
+            left, right = ((pawns & NOT_FILE_A) << 7) & enemy, ((pawns & NOT_FILE_H) << 9) & FULL_BOARD & enemy
+            step, deltas, promotionRank, doubleRank = 8, (-8, -16, -7, -9), RANK_1, RANK_6
+        for targets, delta, codes in ((single, deltas[0], None), (double, deltas[1], None),
+                                      (left, deltas[2], captureCodes), (right, deltas[3], captureCodes)):
+            if targets & targetMask:
+                addPawnMoves(moves, targets & targetMask, delta, base, promotionRank, pb, codes)
+
+        pawnAttacks = PAWN_ATTACKS[ally]
+        while pinnedPawns:
+            bit = pinnedPawns & -pinnedPawns
+            pinnedPawns ^= bit
+            sq = bit.bit_length() - 1
+            oneStep = sq + step
+            targets = 0
+            if SQUARE_BITS[oneStep] & empty:
+                targets |= SQUARE_BITS[oneStep]
+                if SQUARE_BITS[oneStep] & doubleRank and SQUARE_BITS[oneStep + step] & empty:
+                    targets |= SQUARE_BITS[oneStep + step]
+            targets |= pawnAttacks[sq] & enemy
+            for endSq in squares(targets & targetMask & pins[sq]):
+                addPawnMoves(moves, SQUARE_BITS[endSq], sq - endSq, base, promotionRank, pb,
+                             captureCodes if SQUARE_BITS[endSq] & enemy else None)
+
+        if self.enpassantPossible:
+            epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+            capturedSq = epSq - step
+            for sq in squares(PAWN_ATTACKS[opponent][epSq] & pb[ally + 'p']):
+                # Lift both pawns and drop ours on the target; legal only if nothing then attacks our king
+                occupied = self.occupied ^ SQUARE_BITS[sq] ^ SQUARE_BITS[capturedSq] ^ SQUARE_BITS[epSq]
+                if not self.attackersTo(kingSq, opponent, occupied) & ~SQUARE_BITS[capturedSq]:
+                    move = NEW_MOVE(Move)
+                    move.packed = base | sq | epSq << 6 | PIECE_CODES[opponent + 'p'] << 16 | ENPASSANT_FLAG
+                    moves.append(move)
+
+    def getBitboardCastleMoves(self, moves, ally, kingSq, base):
+        rights = self.currentCastleRights
+        if ally == 'w':
+            kingside, queenside = rights.wks, rights.wqs
+        else:
+            kingside, queenside = rights.bks, rights.bqs
+        if not (kingside or queenside):
+            return
+        rook, occupied = self.pieceBitboards[ally + 'R'], self.occupied
+        opponent = 'b' if ally == 'w' else 'w'
+        if kingside and SQUARE_BITS[kingSq + 3] & rook and \
+                not (SQUARE_BITS[kingSq + 1] | SQUARE_BITS[kingSq + 2]) & occupied and \
+                not self.isAttacked(kingSq + 1, opponent, occupied) and not self.isAttacked(kingSq + 2, opponent, occupied):
+            move = NEW_MOVE(Move)
+            move.packed = base | (kingSq + 2) << 6 | CASTLE_FLAG
+            moves.append(move)
+        if queenside and SQUARE_BITS[kingSq - 4] & rook and \
+                not (SQUARE_BITS[kingSq - 1] | SQUARE_BITS[kingSq - 2] | SQUARE_BITS[kingSq - 3]) & occupied and \
+                not self.isAttacked(kingSq - 1, opponent, occupied) and not self.isAttacked(kingSq - 2, opponent, occupied):
+            move = NEW_MOVE(Move)
+            move.packed = base | (kingSq - 2) << 6 | CASTLE_FLAG
+            moves.append(move)
+
+    def compareMoveLists(self, moves, legacyMoves):
+        """Raises an AssertionError if the bitboard and list-of-strings generators disagree on any move, including
+        the pieces it moves and captures and its flags"""
+        bitboardKeys = {move.packed: move for move in moves}
+        legacyKeys = {move.packed: move for move in legacyMoves}
+        if bitboardKeys.keys() != legacyKeys.keys():
+            missing = [m.getChessNotation() for k, m in legacyKeys.items() if k not in bitboardKeys]
+            extra = [m.getChessNotation() for k, m in bitboardKeys.items() if k not in legacyKeys]
+            raise AssertionError("Move generators disagree: bitboard is missing " + str(missing) +
+                                 " and has extra " + str(extra))
@@ -0,0 +1,85 @@
+import mmap
+import os
+import random
+import struct
+
+# A Polyglot book is a file of 16-byte entries sorted by key: key, move, weight and a learn field, big-endian
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+PROMOTION_PIECES = {1: 'N', 2: 'B', 3: 'R', 4: 'Q'}
+
+
+class OpeningBook:
+    """Polyglot .bin opening book, looked up by GameState.zobristKey (the same keys Polyglot uses).
+
+    The file is memory-mapped and binary searched, so only the pages holding the entries for a position are read,
+    however large the book is. Moves past maxPlies (counted from the start of gs.moveLog) are not looked up.
+    """
+
+    def __init__(self, path, maxPlies=None):
+        self.maxPlies = maxPlies
+        self.file = open(path, "rb")
+        size = os.path.getsize(path)
+        self.count = size // ENTRY.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def keyAt(self, index):
+        return KEY.unpack_from(self.data, index * ENTRY.size)[0]
+
+    def entries(self, key):
+        """(polyglot move, weight) of every entry for key, in file order"""
+        low, high = 0, self.count
+        while low < high:  # First entry whose key is not below key
+            mid = (low + high) // 2
+            if self.keyAt(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        found = []
+        while low < self.count:
+            entryKey, move, weight, _ = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((move, weight))
+            low += 1
+        return found
+
+    def getMoves(self, gs, validMoves):
+        """(move, promotion choice, weight) for every book move in gs, matched against validMoves"""
+        if self.maxPlies is not None and len(gs.moveLog) >= self.maxPlies:
+            return []
+        bookMoves = []
+        for polyglotMove, weight in self.entries(gs.zobristKey):
+            move, choice = decodeMove(polyglotMove, gs.board, validMoves)
+            if move is not None:
+                bookMoves.append((move, choice, weight))
+        return bookMoves
+
+    def chooseMove(self, gs, validMoves):
+        """A book move for gs picked at random in proportion to its weight, as (move, promotion choice),
+        or None if the book has nothing for this position"""
+        bookMoves = [bookMove for bookMove in self.getMoves(gs, validMoves) if bookMove[2] > 0]
+        if not bookMoves:
+            return None
+        move, choice, _ = random.choices(bookMoves, weights=[weight for _, _, weight in bookMoves])[0]
+        return move, choice
+
+
+def decodeMove(polyglotMove, board, validMoves):
+    """The move in validMoves a Polyglot move stands for, with its promotion piece ('Q' if none).
+    Polyglot squares count ranks from white's side, and castling is written as the king taking its own rook."""
+    endCol, endRow = polyglotMove & 7, 7 - ((polyglotMove >> 3) & 7)
+    startCol, startRow = (polyglotMove >> 6) & 7, 7 - ((polyglotMove >> 9) & 7)
+    choice = PROMOTION_PIECES.get((polyglotMove >> 12) & 7, 'Q')
+    if board[startRow][startCol][1] == 'K' and startCol == 4 and board[endRow][endCol][1] == 'R' \
+            and board[endRow][endCol][0] == board[startRow][startCol][0]:
+        endCol = 6 if endCol == 7 else 2
+    for move in validMoves:
+        if (move.startRow, move.startCol, move.endRow, move.endCol) == (startRow, startCol, endRow, endCol):
+            return move, choice
+    return None, choice
@@ -1,57 +1,349 @@
 import random
-
-pieceScore = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+import time
+from transposition import TranspositionTable, EXACT, LOWERBOUND, UPPERBOUND
+from evaluation import pieceScore
+import tablebase
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 0
+TABLEBASE_WIN = CHECKMATE / 2  # Score of a won tablebase position, less 0.01 per ply to mate
+TT_SIZE_MB = 16
+transpositionTable = TranspositionTable(TT_SIZE_MB)  # Shared by findBestMoveAlphaBeta calls, entries from older searches age out
+TIME_CHECK_INTERVAL = 256  # Nodes between clock checks
+KILLER_SCORE = 90000  # Order score of a ply's newest killer move, below every capture, above every history score
+HISTORY_MAX = 60000  # The history table is halved once a score passes this, so it stays below KILLER_SCORE
+# Defaults for new Search objects
+MOVE_ORDERING = True  # Hash move, MVV-LVA captures, killers and history; False searches in generation order
+QUIESCENCE = True  # Keep searching captures at depth 0 instead of scoring in the middle of an exchange
+DELTA_PRUNING = True  # In quiescence, skip captures that can't lift the score to alpha even with DELTA_MARGIN extra
+DELTA_MARGIN = 2
+MATERIAL_WEIGHT = 1.0  # Multipliers of the two evaluation terms, for tuning matches between differently weighted searches
+POSITIONAL_WEIGHT = 1.0
+lastSearch = None  # The Search behind the last findBestMoveAlphaBeta call, for searchStats
 
-def findRandomMove(validMoves):
-    return random.choice(validMoves)
+class SearchTimeout(Exception):
+    """Raised inside alphaBeta when the time budget of the search has run out"""
+
+class SearchResult:
+    """What a search found. score is from white's point of view in pawns, pv the expected line starting with
+    bestMove, depth the deepest completed iteration and nodes the count over all iterations. choice is the piece
+    bestMove promotes to: the search promotes to queens, a tablebase move to whatever keeps its result."""
+    def __init__(self, bestMove=None, score=0, pv=None, depth=0, nodes=0, time=0.0, choice='Q'):
+        self.bestMove = bestMove
+        self.choice = choice
+        self.score = score
+        self.pv = pv if pv is not None else []
+        self.depth = depth
+        self.nodes = nodes
+        self.time = time
+
+class Search:
+    """Alpha-beta search that keeps all of its state (killers, history, counters, clock) on the instance, so
+    several searches can run at once. Searches that should not share results need their own transposition table.
+    stop() may be called from another thread, and deadline may be moved while the search runs.
+    onIteration, if set, is called with the SearchResult of every completed iteration (nodes and time so far)."""
+    def __init__(self, transpositionTable=None, seed=None):
+        self.transpositionTable = transpositionTable if transpositionTable is not None else TranspositionTable(TT_SIZE_MB)
+        self.random = random.Random(seed)  # Shuffles the root moves, seed it (or call its seed()) for a repeatable search
+        self.moveOrdering = MOVE_ORDERING
+        self.useQuiescence = QUIESCENCE
+        self.deltaPruning = DELTA_PRUNING
+        self.deltaMargin = DELTA_MARGIN
+        self.materialWeight = MATERIAL_WEIGHT
+        self.positionalWeight = POSITIONAL_WEIGHT
+        self.stopped = False
+        self.stopEvent = None  # A shared flag (multiprocessing.Event) that stops the search like stop() when set
+        self.deadline = None
+        self.nodeLimit = None
+        self.onIteration = None
+        self.reset(0)
+
+    def reset(self, maxDepth):
+        """Forgets killers, history and counters and ages the transposition table, ready for a new search"""
+        self.transpositionTable.newSearch()
+        self.killerMoves = [[] for _ in range(maxDepth + 1)]  # killerMoves[ply]: IDs of the last two quiet moves that caused a cutoff at that ply
+        self.historyTable = {}  # (pieceMoved, endRow, endCol) -> sum of depth * depth over the cutoffs that quiet move caused, aged by halving
+        self.rootBestMove = None
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0  # Cutoffs by the first move searched, the share of these measures the ordering
+
+    def stop(self):
+        """Ends the running search as if its time had run out"""
+        self.stopped = True
+
+    def run(self, gs, validMoves, maxDepth, timeLimit=None, nodeLimit=None):
+        """Searches 1, 2, ... maxDepth plies deep, starting each iteration from the previous best move.
+        With a timeLimit (seconds) or nodeLimit the search is cut off when it runs out and the result of the
+        deepest completed iteration is returned. Depth 1 always completes so there is always a move to play, unless
+        stop() is called, which ends the search at once (bestMove may then be None). Each iteration is a searchRoot
+        call, which parallel.ParallelSearch replaces to spread the root moves over its workers."""
+        self.random.shuffle(validMoves)
+        self.reset(maxDepth)
+        self.deadline, self.nodeLimit = None, None
+        startTime = time.perf_counter()
+        tablebaseMove = tablebase.bestMove(gs, validMoves)
+        if tablebaseMove is not None:  # Known ending, no need to search
+            move, choice, outcome = tablebaseMove
+            result = SearchResult(move, tablebaseScore(outcome), [move], 0, 0, time.perf_counter() - startTime, choice)
+            if self.onIteration is not None:
+                self.onIteration(result)
+            return result
+        rootLength = len(gs.moveLog)
+        result = SearchResult()
+        for depth in range(1, maxDepth + 1):
+            try:
+                bestMove, score, pv = self.searchRoot(gs, validMoves, depth, maxDepth)
+            except SearchTimeout:
+                while len(gs.moveLog) > rootLength:  # Unwind the moves the interrupted iteration had made
+                    gs.undoMove()
+                break
+            if bestMove is not None:
+                validMoves.sort(key=lambda move: move is not bestMove)  # Best move first for the next iteration
+            result = SearchResult(bestMove, score, pv, depth, self.nodes, time.perf_counter() - startTime)
+            if self.onIteration is not None:
+                self.onIteration(result)
+            if abs(score) >= CHECKMATE or self.stopped:
+                break  # Forced mate found, deeper search can't improve on it
+            if timeLimit is not None:
+                self.deadline = startTime + timeLimit
+                if time.perf_counter() >= self.deadline:
+                    break
+            if nodeLimit is not None:
+                self.nodeLimit = nodeLimit
+                if self.nodes >= nodeLimit:
+                    break
+        self.deadline, self.nodeLimit = None, None
+        result.nodes = self.nodes
+        result.time = time.perf_counter() - startTime
+        return result
 
-def findBestMoveAlphaBeta(gs, validMoves, AIDepth=0):
-    global nextMove
-    global DEPTH
-    DEPTH= AIDepth
-    nextMove = None
-    random.shuffle(validMoves)
-    alphaBeta(gs, validMoves, AIDepth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    return nextMove
-
-def alphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
-    global DEPTH
-    if depth == 0:
-        return scoreBoard(gs)
-    if turnMultiplier == 1:
-        maxScore = -CHECKMATE
-        for move in validMoves:
+    def searchRoot(self, gs, validMoves, depth, maxDepth):
+        """One iteration of run: (best move, score, principal variation) of a depth ply search of the root moves,
+        the previous best first. Raises SearchTimeout if the iteration is cut off. Counts its nodes in self.nodes."""
+        self.rootBestMove = None
+        score = self.alphaBeta(gs, validMoves, depth, 0, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
+        return self.rootBestMove, score, self.principalVariation(gs, self.rootBestMove, depth)
+
+    def checkTime(self):
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and \
+                (self.stopped or (self.stopEvent is not None and self.stopEvent.is_set()) or
+                 (self.deadline is not None and time.perf_counter() >= self.deadline) or
+                 (self.nodeLimit is not None and self.nodes >= self.nodeLimit)):
+            raise SearchTimeout()
+
+    def alphaBeta(self, gs, validMoves, depth, ply, alpha, beta, turnMultiplier):
+        """Pass validMoves=None to have them generated only if the transposition table can't answer.
+        ply counts the moves made since the root, where the best move is recorded in rootBestMove."""
+        if ply > 0 and gs.isRepetition():
+            return STALEMATE  # Whoever could avoid the repetition didn't, so it is scored as a draw right away
+        if depth == 0 and self.useQuiescence:
+            return self.quiescence(gs, alpha, beta, turnMultiplier)
+        self.nodes += 1
+        self.checkTime()
+        alphaOrig, betaOrig = alpha, beta
+        ttMoveID = None
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        if entry is not None:
+            ttDepth, ttScore, ttFlag, ttMoveID = entry
+            if ttDepth >= depth and ply > 0:  # The root has to search so it can pick rootBestMove
+                if ttFlag == EXACT:
+                    return ttScore
+                elif ttFlag == LOWERBOUND:
+                    alpha = max(alpha, ttScore)
+                else:
+                    beta = min(beta, ttScore)
+                if alpha >= beta:
+                    return ttScore
+        if depth == 0:  # Leaf: only whether the game is over matters, not the moves themselves
+            score = terminalScore(gs)
+            if score is None:
+                score = scorePosition(gs, self.materialWeight, self.positionalWeight)
+            self.transpositionTable.store(gs.zobristKey, depth, score, EXACT, None)
+            return score
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            score = scoreBoard(gs)
+            self.transpositionTable.store(gs.zobristKey, depth, score, EXACT, None)
+            return score
+        if self.moveOrdering:
+            validMoves = self.orderMoves(validMoves, ttMoveID, ply)
+        bestMoveID = None
+        if turnMultiplier == 1:
+            maxScore = -CHECKMATE
+            for i, move in enumerate(validMoves):
+                gs.makeMove(move)
+                score = self.alphaBeta(gs, None, depth - 1, ply + 1, alpha, beta, -turnMultiplier)
+                if score > maxScore or i == 0:  # The first move stands even if every move is mated
+                    maxScore = score
+                    bestMoveID = move.moveID
+                    if ply == 0:
+                        self.rootBestMove = move
+                gs.undoMove()
+                alpha = max(alpha, maxScore)
+                if alpha >= beta:
+                    self.recordCutoff(move, depth, ply, i == 0)
+                    break
+            bestScore = maxScore
+        else:
+            minScore = CHECKMATE
+            for i, move in enumerate(validMoves):
+                gs.makeMove(move)
+                score = self.alphaBeta(gs, None, depth - 1, ply + 1, alpha, beta, -turnMultiplier)
+                if score < minScore or i == 0:  # The first move stands even if every move is mated
+                    minScore = score
+                    bestMoveID = move.moveID
+                    if ply == 0:
+                        self.rootBestMove = move
+                gs.undoMove()
+                beta = min(beta, minScore)
+                if alpha >= beta:
+                    self.recordCutoff(move, depth, ply, i == 0)
+                    break
+            bestScore = minScore
+        if bestScore <= alphaOrig:
+            flag = UPPERBOUND
+        elif bestScore >= betaOrig:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        self.transpositionTable.store(gs.zobristKey, depth, bestScore, flag, bestMoveID)
+        return bestScore
+
+    def quiescence(self, gs, alpha, beta, turnMultiplier):
+        """Searches only captures and promotions (every move when in check) until the position is quiet"""
+        self.nodes += 1
+        self.quiescenceNodes += 1
+        self.checkTime()
+        score = terminalScore(gs)  # Also brings gs.inCheck up to date
+        if score is not None:
+            return score
+        standPat = scorePosition(gs, self.materialWeight, self.positionalWeight)
+        if gs.inCheck:  # Standing pat is no option in check, every evasion is searched
+            moves = sorted(gs.getValidMoves(), key=captureScore, reverse=True)
+            bestScore = -CHECKMATE * turnMultiplier
+        else:
+            if turnMultiplier == 1:
+                if standPat >= beta:
+                    return standPat
+                alpha = max(alpha, standPat)
+            else:
+                if standPat <= alpha:
+                    return standPat
+                beta = min(beta, standPat)
+            # Moves are only generated once standing pat has failed to cut off
+            moves = sorted([move for move in gs.getValidMoves() if move.pieceCaptured != "--" or move.isPawnPromotion],
+                           key=captureScore, reverse=True)
+            bestScore = standPat
+        for move in moves:
+            if self.deltaPruning and not gs.inCheck:
+                gain = pieceScore[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+                if move.isPawnPromotion:
+                    gain += pieceScore["Q"] - pieceScore["p"]
+                if (turnMultiplier == 1 and standPat + gain + self.deltaMargin <= alpha) or \
+                        (turnMultiplier == -1 and standPat - gain - self.deltaMargin >= beta):
+                    continue
             gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
-            score = alphaBeta(gs, nextMoves, depth - 1, alpha, beta, -turnMultiplier)
-            if score > maxScore:
-                maxScore = score
-                if depth == DEPTH:
-                    nextMove = move
+            score = self.quiescence(gs, alpha, beta, -turnMultiplier)
             gs.undoMove()
-            alpha = max(alpha, maxScore)
+            if turnMultiplier == 1:
+                bestScore = max(bestScore, score)
+                alpha = max(alpha, bestScore)
+            else:
+                bestScore = min(bestScore, score)
+                beta = min(beta, bestScore)
             if alpha >= beta:
                 break
-        return maxScore
-    else:
-        minScore = CHECKMATE
-        for move in validMoves:
+        return bestScore
+
+    def orderMoves(self, validMoves, ttMoveID, ply):
+        """Sorts the hash move first, then captures and promotions by most valuable victim / least valuable
+        attacker, then this ply's killer moves, then the remaining quiet moves by history score"""
+        killers = self.killerMoves[ply] if ply < len(self.killerMoves) else []
+        historyTable = self.historyTable
+        def moveScore(move):
+            if move.moveID == ttMoveID:
+                return 1000000
+            if move.pieceCaptured != "--" or move.isPawnPromotion:
+                return captureScore(move)
+            if move.moveID in killers:
+                return KILLER_SCORE - killers.index(move.moveID)
+            return historyTable.get((move.pieceMoved, move.endRow, move.endCol), 0)
+        return sorted(validMoves, key=moveScore, reverse=True)
+
+    def recordCutoff(self, move, depth, ply, firstMove):
+        """Counts a beta cutoff and, for a quiet move, remembers it as a killer and in the history table. Once a
+        history score passes HISTORY_MAX every score is halved, which keeps their order but lets newer cutoffs count
+        for more than old ones."""
+        self.betaCutoffs += 1
+        if firstMove:
+            self.firstMoveCutoffs += 1
+        if move.pieceCaptured == "--" and not move.isPawnPromotion:
+            if ply < len(self.killerMoves):
+                killers = self.killerMoves[ply]
+                if move.moveID not in killers:
+                    killers.insert(0, move.moveID)
+                    del killers[2:]
+            historyTable = self.historyTable
+            historyKey = (move.pieceMoved, move.endRow, move.endCol)
+            historyTable[historyKey] = historyTable.get(historyKey, 0) + depth * depth
+            if historyTable[historyKey] > HISTORY_MAX:
+                for key in historyTable:
+                    historyTable[key] //= 2
+
+    def principalVariation(self, gs, firstMove, maxLength):
+        """The line the search expects: firstMove (the hash move of gs if None), then the hash move of each
+        following position, for as long as the table has one and up to maxLength moves"""
+        pv = []
+        move = firstMove
+        if move is None:
+            move = self.hashMove(gs, gs.getValidMoves())
+        while move is not None and len(pv) < maxLength:
+            pv.append(move)
             gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
-            score = alphaBeta(gs, nextMoves, depth - 1, alpha, beta, -turnMultiplier)
-            if score < minScore:
-                minScore = score
-                if depth == DEPTH:
-                    nextMove = move
+            move = self.hashMove(gs, gs.getValidMoves())
+        for _ in pv:
             gs.undoMove()
-            beta = min(beta, minScore)
-            if alpha >= beta:
-                break
-        return minScore
+        return pv
+
+    def hashMove(self, gs, validMoves):
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        if entry is None or entry[3] is None:
+            return None
+        return next((move for move in validMoves if move.moveID == entry[3]), None)
+
+    def stats(self):
+        """Node and cutoff counts of the last search, for comparing the tree size with and without ordering"""
+        return {"nodes": self.nodes, "quiescenceNodes": self.quiescenceNodes,
+                "quiescenceRate": self.quiescenceNodes / self.nodes if self.nodes else 0.0, "betaCutoffs": self.betaCutoffs,
+                "firstMoveCutoffs": self.firstMoveCutoffs,
+                "firstMoveCutoffRate": self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0,
+                "transpositionTable": self.transpositionTable.stats()}
+
+def findRandomMove(validMoves):
+    return random.choice(validMoves)
+
+def findBestMoveAlphaBeta(gs, validMoves, AIDepth=0, timeLimit=None):
+    """Runs a new Search on the shared transpositionTable and returns just its best move"""
+    global lastSearch
+    lastSearch = Search(transpositionTable)
+    return lastSearch.run(gs, validMoves, AIDepth, timeLimit).bestMove
+
+def searchStats():
+    """Search.stats() of the last findBestMoveAlphaBeta call"""
+    return lastSearch.stats() if lastSearch is not None else {}
+
+def captureScore(move):
+    """Most valuable victim / least valuable attacker score of a capture or promotion, 0 for quiet moves"""
+    if move.pieceCaptured == "--" and not move.isPawnPromotion:
+        return 0
+    score = 100000 - pieceScore[move.pieceMoved[1]]
+    if move.pieceCaptured != "--":
+        score += 10 * pieceScore[move.pieceCaptured[1]]
+    if move.isPawnPromotion:
+        score += 10 * pieceScore["Q"]
+    return score
 
 def scoreBoard(gs):
     if gs.checkmate:
@@ -61,16 +353,27 @@ def scoreBoard(gs):
             return CHECKMATE
     elif gs.stalemate:
         return STALEMATE
-    score = scoreMaterial(gs.board)
-    return score
+    return scorePosition(gs)
 
-# Score the board based on material
-def scoreMaterial(board):
-    score = 0
-    for row in board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScore[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScore[square[1]]
-    return score
+def terminalScore(gs):
+    """Score of a finished game, or None while the side to move has a legal move and no draw rule applies.
+    Asks gs.hasLegalMove rather than building the whole move list just to read checkmate/stalemate"""
+    if not gs.hasLegalMove():
+        if not gs.inCheck:
+            return STALEMATE
+        return -CHECKMATE if gs.whiteToMove else CHECKMATE
+    if gs.fiftyMoveCounter >= 50 or gs.insufficientMaterial():
+        return STALEMATE
+    return None
+
+def scorePosition(gs, materialWeight=1.0, positionalWeight=1.0):
+    outcome = tablebase.probe(gs)
+    if outcome is not None:
+        return tablebaseScore(outcome)
+    # Material plus piece-square bonuses, both kept up to date by makeMove/undoMove (in centipawns)
+    return (materialWeight * gs.materialScore + positionalWeight * gs.positionalScore) / 100
+
+def tablebaseScore(outcome):
+    """Score of a tablebase.probe result, so that a quicker mate scores higher"""
+    result, plies = outcome
+    return result * (TABLEBASE_WIN - plies / 100)
@@ -1,8 +1,12 @@
-from moves import MoveGenerator, Move, CastleRights
+from moves import MoveGenerator, Move, CastleRights, QUEEN_RAYS, ROOK_RAYS, BISHOP_RAYS, KNIGHT_TARGETS, \
+    KING_TARGETS, PAWN_TARGETS
+import zobrist
+import evaluation
 
 class GameState(MoveGenerator):
 
-    def __init__(self):
+    def __init__(self, fen=None):
+        """The starting position, or the position described by fen"""
         super().__init__()
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"], 
@@ -21,17 +25,122 @@ class GameState(MoveGenerator):
         self.whiteKingLocation , self.blackKingLocation = (7, 4), (0, 4)
         self.inCheck = False
         self.checkmate, self.stalemate = False, False
-        self.pins, self.checks = [], []
+        self.pins, self.checks = {}, []
+        self.enemyAttacks = set()  # Squares the opponent attacks, rebuilt by every getValidMoves call
         self.enpassantPossible = ()  # Coordinates for the square where en passant capture is possible
         self.currentCastleRights = CastleRights(True, True, True, True)
         self.castleRightsLog = [CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
                                              self.currentCastleRights.wqs, self.currentCastleRights.bqs)]
         self.fiftyMoveCounter = 0
+        self.startPly = 0  # Plies played before the start of moveLog, for the FEN move number
+        self.zobristKey = zobrist.computeHash(self)  # 64-bit position key, updated by makeMove and undoMove
+        self.keyHistory = [self.zobristKey]  # zobristKey of every position of the game so far, pushed and popped with moves
+        # Running material and piece-square totals (centipawns, white positive) and how many of each piece is left
+        self.materialScore, self.positionalScore, self.pieceCounts = evaluation.computeEvaluation(self.board)
+        if fen is not None:
+            self.loadFEN(fen)
+
+    def loadFEN(self, fen):
+        """Sets up the position described by a FEN string, replacing the current game"""
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError("FEN board needs 8 rows: " + fen)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("FEN side to move must be w or b: " + fen)
+        board = []
+        kings = {}
+        for r, row in enumerate(rows):
+            squares = []
+            for symbol in row:
+                if symbol.isdigit():
+                    squares.extend(["--"] * int(symbol))
+                elif symbol.upper() in "PNBRQK":
+                    piece = ('w' if symbol.isupper() else 'b') + ('p' if symbol in "Pp" else symbol.upper())
+                    if piece[1] == 'K':
+                        if piece in kings:
+                            raise ValueError("FEN has two " + piece + " kings: " + fen)
+                        kings[piece] = (r, len(squares))
+                    elif piece[1] == 'p' and r in (0, 7):
+                        raise ValueError("FEN has a pawn on the first or last rank: " + fen)
+                    squares.append(piece)
+                else:
+                    raise ValueError("Unknown piece '" + symbol + "' in FEN: " + fen)
+            if len(squares) != 8:
+                raise ValueError("FEN row " + row + " does not have 8 squares")
+            board.append(squares)
+        if len(kings) != 2:
+            raise ValueError("FEN needs one king of each colour: " + fen)
+        whiteToMove = fields[1] == 'w'
+        # Only the rank the side to move's pawns capture onto can hold the en passant square
+        enpassant = fields[3]
+        if enpassant == '-':
+            enpassantPossible = ()
+        elif len(enpassant) == 2 and enpassant[0] in Move.filesToCols and enpassant[1] == ('6' if whiteToMove else '3'):
+            enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        else:
+            raise ValueError("Bad en passant square '" + enpassant + "' in FEN: " + fen)
+        try:
+            fiftyMoveCounter = int(fields[4]) if len(fields) > 4 else 0
+            fullMoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("FEN move counters must be numbers: " + fen)
+        self.board = board
+        self.whiteKingLocation, self.blackKingLocation = kings["wK"], kings["bK"]
+        self.whiteToMove = whiteToMove
+        # A castling right is only kept while its king and rook are still on their home squares
+        castling = fields[2]
+        self.currentCastleRights = CastleRights(
+            'K' in castling and board[7][4] == "wK" and board[7][7] == "wR",
+            'k' in castling and board[0][4] == "bK" and board[0][7] == "bR",
+            'Q' in castling and board[7][4] == "wK" and board[7][0] == "wR",
+            'q' in castling and board[0][4] == "bK" and board[0][0] == "bR")
+        self.castleRightsLog = [CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
+                                             self.currentCastleRights.wqs, self.currentCastleRights.bqs)]
+        self.enpassantPossible = enpassantPossible
+        self.fiftyMoveCounter = fiftyMoveCounter
+        self.startPly = 2 * (max(fullMoveNumber, 1) - 1) + (0 if self.whiteToMove else 1)
+        self.moveLog = []
+        self.inCheck = False
+        self.checkmate, self.stalemate = False, False
+        self.pins, self.checks = {}, []
+        self.zobristKey = zobrist.computeHash(self)
+        self.keyHistory = [self.zobristKey]
+        self.materialScore, self.positionalScore, self.pieceCounts = evaluation.computeEvaluation(self.board)
+
+    def getFEN(self):
+        """The current position as a FEN string"""
+        rows = []
+        for row in self.board:
+            text, empty = "", 0
+            for square in row:
+                if square == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    text, empty = text + str(empty), 0
+                text += square[1].upper() if square[0] == 'w' else square[1].lower()
+            rows.append(text + (str(empty) if empty else ""))
+        rights = self.currentCastleRights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + \
+            ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.enpassantPossible:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = "-"
+        fullMoveNumber = (self.startPly + len(self.moveLog)) // 2 + 1
+        return " ".join(["/".join(rows), 'w' if self.whiteToMove else 'b', castling or "-", enpassant,
+                         str(self.fiftyMoveCounter), str(fullMoveNumber)])
 
     def makeMove(self, move, choice='Q'):
+        # Take out the castling rights and en passant file of the position we are leaving
+        self.zobristKey ^= zobrist.castleKey(self.currentCastleRights) ^ \
+            zobrist.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append((move, self.enpassantPossible))
+        self.moveLog.append((move, self.enpassantPossible, self.fiftyMoveCounter))
         self.whiteToMove = not self.whiteToMove
         if move.pieceMoved == "wK":
             self.whiteKingLocation = (move.endRow, move.endCol)
@@ -79,9 +188,64 @@ class GameState(MoveGenerator):
         else:
             self.fiftyMoveCounter = 0
 
+        placed = self.board[move.endRow][move.endCol]
+        self.zobristKey ^= self.zobristMoveKey(move, placed) ^ \
+            zobrist.castleKey(self.currentCastleRights) ^ \
+            zobrist.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
+        self.keyHistory.append(self.zobristKey)
+        self.updateEvaluation(move, placed, 1)
+
+    def updateEvaluation(self, move, placed, sign):
+        """Adds (sign 1) or takes back (sign -1) what a move changes in material, piece-square totals and counts"""
+        values, tables, counts = evaluation.PIECE_VALUES, evaluation.PIECE_SQUARE_TABLES, self.pieceCounts
+        startSq, endSq = move.startRow * 8 + move.startCol, move.endRow * 8 + move.endCol
+        material = values[placed] - values[move.pieceMoved]
+        positional = tables[placed][endSq] - tables[move.pieceMoved][startSq]
+        if placed != move.pieceMoved:  # Promotion
+            counts[move.pieceMoved] -= sign
+            counts[placed] += sign
+        captured = move.pieceCaptured
+        if captured != "--":
+            capturedSq = move.startRow * 8 + move.endCol if move.isEnpassantMove else endSq
+            material -= values[captured]
+            positional -= tables[captured][capturedSq]
+            counts[captured] -= sign
+        if move.isCastleMove:
+            rookTable = tables[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2:  # King side castle
+                positional += rookTable[endSq - 1] - rookTable[endSq + 1]
+            else:  # Queen side castle
+                positional += rookTable[endSq + 1] - rookTable[endSq - 2]
+        self.materialScore += sign * material
+        self.positionalScore += sign * positional
+
+    def zobristMoveKey(self, move, placed):
+        """XOR of the keys for every piece the move lifts or drops, plus the side to move"""
+        pieceKeys = zobrist.PIECE_KEYS
+        startSq, endSq = move.startRow * 8 + move.startCol, move.endRow * 8 + move.endCol
+        key = zobrist.WHITE_TO_MOVE_KEY ^ pieceKeys[move.pieceMoved][startSq] ^ pieceKeys[placed][endSq]
+        if move.isEnpassantMove:
+            key ^= pieceKeys[move.pieceCaptured][move.startRow * 8 + move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= pieceKeys[move.pieceCaptured][endSq]
+        if move.isCastleMove:
+            rookKeys = pieceKeys[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2:  # King side castle
+                key ^= rookKeys[endSq + 1] ^ rookKeys[endSq - 1]
+            else:  # Queen side castle
+                key ^= rookKeys[endSq - 2] ^ rookKeys[endSq + 1]
+        return key
+
     def undoMove(self):
         if len(self.moveLog) != 0:
-            move, self.enpassantPossible = self.moveLog.pop()
+            move = self.moveLog[-1][0]
+            placed = self.board[move.endRow][move.endCol]
+            self.updateEvaluation(move, placed, -1)
+            self.keyHistory.pop()
+            self.zobristKey ^= self.zobristMoveKey(move, placed) ^ \
+                zobrist.castleKey(self.currentCastleRights) ^ \
+                zobrist.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
+            move, self.enpassantPossible, self.fiftyMoveCounter = self.moveLog.pop()
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove
@@ -89,14 +253,10 @@ class GameState(MoveGenerator):
                 self.whiteKingLocation = (move.startRow, move.startCol)
             elif move.pieceMoved == "bK":
                 self.blackKingLocation = (move.startRow, move.startCol)
-            # Undo enpassant move
+            # Undo enpassant move (enpassantPossible and fiftyMoveCounter come back from the move log)
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--" # Leave landing square blank
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            # Undo 2 square pawn advance
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
             # Undo castling rights
             self.castleRightsLog.pop() # Get rid of new castle rights from the move we are undoing
             castleRights = self.castleRightsLog[-1] # Set the current castle rights to the last one in the list
@@ -110,14 +270,38 @@ class GameState(MoveGenerator):
                     self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
                     self.board[move.endRow][move.endCol+1] = '--'
             self.checkmate, self.stalemate = False, False
+            self.zobristKey ^= zobrist.castleKey(self.currentCastleRights) ^ \
+                zobrist.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
 
-            # Update fifty-move rule counter
-            if move.pieceCaptured == "--" and move.pieceMoved[1] != 'p':
-                self.fiftyMoveCounter -= 1
-            else:
-                self.fiftyMoveCounter = 0
+    def isRepetition(self):
+        """True if the current position has occurred before. Only positions with the same side to move since the
+        last capture or pawn move (the fifty-move counter) can match, so only those keys are compared."""
+        history, key = self.keyHistory, self.zobristKey
+        last = len(history) - 1
+        for i in range(last - 4, last - min(self.fiftyMoveCounter, last) - 1, -2):
+            if history[i] == key:
+                return True
+        return False
+
+    def repetitionCount(self):
+        """How many times the current position has occurred, this time included"""
+        history, key = self.keyHistory, self.zobristKey
+        last = len(history) - 1
+        return 1 + sum(1 for i in range(last - 4, last - min(self.fiftyMoveCounter, last) - 1, -2) if history[i] == key)
 
     def updateCastleRights(self, move):
+        # A rook captured on its starting square takes that side's castling right with it
+        if move.pieceCaptured == 'wR':
+            if (move.endRow, move.endCol) == (7, 0):
+                self.currentCastleRights.wqs = False
+            elif (move.endRow, move.endCol) == (7, 7):
+                self.currentCastleRights.wks = False
+        elif move.pieceCaptured == 'bR':
+            if (move.endRow, move.endCol) == (0, 0):
+                self.currentCastleRights.bqs = False
+            elif (move.endRow, move.endCol) == (0, 7):
+                self.currentCastleRights.bks = False
+
         if move.pieceMoved == 'wK':
             self.currentCastleRights.wks = self.currentCastleRights.wqs = False
         elif move.pieceMoved == 'bK':
@@ -142,6 +326,7 @@ class GameState(MoveGenerator):
         """Gets all moves considering checks"""
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        self.enemyAttacks = self.getAttackedSquares()
 
         # Updates king locations
         if self.whiteToMove:
@@ -152,36 +337,22 @@ class GameState(MoveGenerator):
         if self.inCheck:
             if len(self.checks) == 1:  # Only 1 check: block check or move king
                 moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                check_row, check_column = check[0], check[1]
-                piece_checking = self.board[check_row][check_column]  # Enemy piece causing check
-                valid_squares = []
-                if piece_checking[1] == 'N':# If knight, must capture knight or move king
-                    valid_squares = [(check_row, check_column)]
-                else:# If rook, bishop, or queen, block check or move king
-                    for i in range(1, len(self.board)):
-                        valid_square = (king_row + check[2] * i, king_column + check[3] * i)  # 2 & 3 = check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_column:# Once you reach piece and check
-                            break
-                for i in range(len(moves) - 1, -1, -1):  # Gets rid of move not blocking, checking, or moving king
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in valid_squares:
-                            moves.remove(moves[i])
+                validSquares = self.getCheckEvasionSquares(king_row, king_column)
+                moves = [move for move in moves if move.pieceMoved[1] == 'K' or self.evadesCheck(move, validSquares)]
             else:  # Double check, king must move
                 self.getKingMoves(king_row, king_column, moves, self.board, self.whiteToMove)
         else:  # Not in check
             moves = self.getAllPossibleMoves()
 
-        if len(moves) == 0:  # Either checkmate or stalemate
-            self.checkmate, self.stalemate = self.inCheck, not self.inCheck
-        else:
-            self.checkmate, self.stalemate = False, False
-            
         if self.whiteToMove:
             self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves, self.board, self.whiteToMove)
         else:
             self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves, self.board, self.whiteToMove)
+
+        if len(moves) == 0:  # Either checkmate or stalemate
+            self.checkmate, self.stalemate = self.inCheck, not self.inCheck
+        else:
+            self.checkmate, self.stalemate = False, False
         
         self.enpassantPossible = tempEnpassantPossible
         self.currentCastleRights = tempCastleRights 
@@ -194,8 +365,69 @@ class GameState(MoveGenerator):
         if self.insufficientMaterial():
             self.stalemate = True
 
+        # Check for threefold repetition
+        if self.repetitionCount() >= 3:
+            self.stalemate = True
+
         return moves
 
+    def getCheckEvasionSquares(self, king_row, king_column):
+        """With a single check, the squares a piece other than the king can move to: the checker's square and,
+        for a sliding checker, the squares between it and the king"""
+        check = self.checks[0]
+        check_row, check_column = check[0], check[1]
+        piece_checking = self.board[check_row][check_column]  # Enemy piece causing check
+        if piece_checking[1] == 'N':  # If knight, must capture knight or move king
+            return {(check_row, check_column)}
+        validSquares = set()  # If rook, bishop, or queen, block check or move king
+        for i in range(1, len(self.board)):
+            validSquare = (king_row + check[2] * i, king_column + check[3] * i)  # 2 & 3 = check directions
+            validSquares.add(validSquare)
+            if validSquare == (check_row, check_column):  # Once you reach piece and check
+                break
+        return validSquares
+
+    def evadesCheck(self, move, validSquares):
+        """A non-king move answers a single check by landing on validSquares, or by taking the checking pawn en passant"""
+        return (move.endRow, move.endCol) in validSquares or \
+            (move.isEnpassantMove and (move.startRow, move.endCol) in validSquares)
+
+    def hasLegalMove(self):
+        """True if the side to move has any legal move. Stops at the first one, so it is much cheaper than
+        getValidMoves when only checkmate or stalemate matters. Like getValidMoves it updates self.inCheck"""
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.whiteToMove:
+            ally, (king_row, king_column) = 'w', self.whiteKingLocation
+        else:
+            ally, (king_row, king_column) = 'b', self.blackKingLocation
+
+        if len(self.checks) < 2:  # In double check only the king can move
+            validSquares = self.getCheckEvasionSquares(king_row, king_column) if self.inCheck else None
+            moves = []
+            for row in range(len(self.board)):
+                for column in range(len(self.board[row])):
+                    piece = self.board[row][column]
+                    if piece[0] == ally and piece[1] != 'K':
+                        self.moveFunctions[piece[1]](row, column, moves, self.board, self.whiteToMove)
+                        if validSquares is not None:
+                            moves = [move for move in moves if self.evadesCheck(move, validSquares)]
+                        if moves:
+                            return True
+
+        # Only the king is left to try, and castling is never the only legal king move. Each square it could step
+        # to is tested on its own, with the king lifted off the board so it cannot hide behind itself
+        board = self.board
+        king = board[king_row][king_column]
+        board[king_row][king_column] = "--"
+        escapes = False
+        for endRow, endCol in KING_TARGETS[king_row][king_column]:
+            endPiece = board[endRow][endCol]
+            if (endPiece == "--" or endPiece[0] != ally) and not self.squareUnderAttack(endRow, endCol):
+                escapes = True
+                break
+        board[king_row][king_column] = king
+        return escapes
+
     def getAllPossibleMoves(self):
         """Gets all moves without considering checks"""
         moves = []
@@ -208,8 +440,8 @@ class GameState(MoveGenerator):
         return moves
 
     def checkForPinsAndChecks(self):
-        """Returns if the player is in check, a list of pins, and a list of checks"""
-        pins = []
+        """Returns if the player is in check, a dict of pinned squares to pin directions, and a list of checks"""
+        pins = {}
         checks = []
         inCheck = False
 
@@ -220,68 +452,106 @@ class GameState(MoveGenerator):
             opponent, ally = 'w', 'b'
             startRow, startCol = self.blackKingLocation
 
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
+        for j, (d, ray) in enumerate(QUEEN_RAYS[startRow][startCol]):  # j < 4: orthogonal, j >= 4: diagonal
             possiblePin = ()  # Resets possible pins
-            for i in range(1, len(self.board)):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board):
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == ally and endPiece[1] != 'K':
-                        if possiblePin == ():  # 1st ally piece can be pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:  # 2nd ally piece, so no pin or check possible
+            for i, (endRow, endCol) in enumerate(ray, 1):
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == ally and endPiece[1] != 'K':
+                    if possiblePin == ():  # 1st ally piece can be pinned
+                        possiblePin = ((endRow, endCol), d)
+                    else:  # 2nd ally piece, so no pin or check possible
+                        break
+                elif endPiece[0] == opponent:
+                    pieceType = endPiece[1]
+                    if (0 <= j <= 3 and pieceType == 'R') or (4 <= j <= 7 and pieceType == 'B') or \
+                            (i == 1 and pieceType == 'p' and ((opponent == 'w' and 6 <= j <= 7)
+                                                               or (opponent == 'b' and 4 <= j <= 5))) or \
+                            (pieceType == 'Q') or (i == 1 and pieceType == 'K'):
+                        if possiblePin == ():  # no piece blocking, so check
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == opponent:
-                        pieceType = endPiece[1]
-                        if (0 <= j <= 3 and pieceType == 'R') or (4 <= j <= 7 and pieceType == 'B') or \
-                                (i == 1 and pieceType == 'p' and ((opponent == 'w' and 6 <= j <= 7)
-                                                                   or (opponent == 'b' and 4 <= j <= 5))) or \
-                                (pieceType == 'Q') or (i == 1 and pieceType == 'K'):
-                            if possiblePin == ():  # no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:  # Piece blocking, so pin
-                                pins.append(possiblePin)
-                                break
-                        else:  # Enemy piece but not applying check
+                        else:  # Piece blocking, so pin
+                            pins[possiblePin[0]] = possiblePin[1]
                             break
-                else:  # Off board
-                    break
+                    else:  # Enemy piece but not applying check
+                        break
 
         # Check for knight checks cause they are a bit different
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for move in knightMoves:
-            endRow = startRow + move[0]
-            endCol = startCol + move[1]
-            if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == opponent and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow, endCol, move[0], move[1]))
+        for endRow, endCol in KNIGHT_TARGETS[startRow][startCol]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] == opponent and endPiece[1] == 'N':
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
 
         return inCheck, pins, checks
 
+    def getAttackedSquares(self):
+        """Every square the opponent attacks, in one pass over the opponent's pieces. The king of the side to move
+        is lifted off the board first, so the squares behind it on a checking ray count as attacked too"""
+        board = self.board
+        opponent = 'b' if self.whiteToMove else 'w'
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        king = board[kingRow][kingCol]
+        board[kingRow][kingCol] = "--"
+        attacked = set()
+        pawnTargets = PAWN_TARGETS[opponent]
+        sliderRays = {'R': ROOK_RAYS, 'B': BISHOP_RAYS, 'Q': QUEEN_RAYS}
+        for r in range(8):
+            row = board[r]
+            for c in range(8):
+                piece = row[c]
+                if piece[0] != opponent:
+                    continue
+                pieceType = piece[1]
+                if pieceType == 'p':
+                    attacked.update(pawnTargets[r][c])
+                elif pieceType == 'N':
+                    attacked.update(KNIGHT_TARGETS[r][c])
+                elif pieceType == 'K':
+                    attacked.update(KING_TARGETS[r][c])
+                else:
+                    for d, ray in sliderRays[pieceType][r][c]:
+                        for endRow, endCol in ray:
+                            attacked.add((endRow, endCol))
+                            if board[endRow][endCol] != "--":
+                                break
+        board[kingRow][kingCol] = king
+        return attacked
+
     def squareUnderAttack(self, row, col):
-        """Determine if a square is under attack by any of the opponent's pieces"""
-        self.whiteToMove = not self.whiteToMove  # Switch to opponent's turn
-        opponent_moves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # Switch turns back
-        for move in opponent_moves:
-            if move.endRow == row and move.endCol == col:
+        """Determine if a square is under attack by any of the opponent's pieces, looking outward from the square
+        for knights, the king, pawns and sliders and stopping at the first attacker found"""
+        board = self.board
+        opponent = 'b' if self.whiteToMove else 'w'
+        knight, king, pawn = opponent + 'N', opponent + 'K', opponent + 'p'
+        for endRow, endCol in KNIGHT_TARGETS[row][col]:
+            if board[endRow][endCol] == knight:
                 return True
+        for endRow, endCol in KING_TARGETS[row][col]:
+            if board[endRow][endCol] == king:
+                return True
+        pawnRow = row - 1 if self.whiteToMove else row + 1  # Pawns attack towards the side to move
+        if 0 <= pawnRow < len(board):
+            if (col > 0 and board[pawnRow][col - 1] == pawn) or (col < 7 and board[pawnRow][col + 1] == pawn):
+                return True
+        for j, (d, ray) in enumerate(QUEEN_RAYS[row][col]):  # j < 4: orthogonal, j >= 4: diagonal
+            sliders = (opponent + 'R', opponent + 'Q') if j < 4 else (opponent + 'B', opponent + 'Q')
+            for endRow, endCol in ray:
+                piece = board[endRow][endCol]
+                if piece != "--":
+                    if piece in sliders:
+                        return True
+                    break
         return False
 
     def insufficientMaterial(self):
         """Check for insufficient material to checkmate"""
-        pieces = [piece for row in self.board for piece in row if piece != "--"]
-        if len(pieces) == 2:
+        counts = self.pieceCounts
+        pieces = sum(counts.values())
+        if pieces == 2:
             return True  # Only kings left
-        if len(pieces) == 3:
-            if pieces.count("wK") == 1 and pieces.count("bK") == 1:
-                if pieces.count("wB") == 1 or pieces.count("wN") == 1 or pieces.count("bB") == 1 or pieces.count("bN") == 1:
-                    return True  # One side has only king and bishop/knight
+        if pieces == 3:
+            if counts["wB"] == 1 or counts["wN"] == 1 or counts["bB"] == 1 or counts["bN"] == 1:
+                return True  # One side has only king and bishop/knight
         return False
@@ -1,6 +1,10 @@
+import os
 import pygame as p
 import computer
+from book import OpeningBook
+from worker import SearchWorker
 from engine import GameState
+from bitboard import BitboardGameState
 from moves import MoveGenerator, Move
 
 WIDTH = HEIGHT = 512
@@ -9,6 +13,12 @@ DIMENSION = 8  # Chess board is 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15  # For animations later on
 AI_Depth = 3
+AI_TIME_LIMIT = 5  # Seconds the AI may think per move, the search deepens until AI_Depth or this runs out
+AI_WORKERS = 1  # Processes the AI searches with, more than 1 spreads the root moves over a process pool
+AI_PONDER = True  # Let the AI think on the move it expects while the human is thinking
+BOOK_PATH = "books/book.bin"  # Polyglot opening book, the AI only searches if the file is missing
+BOOK_MAX_PLIES = 20  # Stop using the book after this many plies
+USE_BITBOARDS = True  # Generate moves from bitboards instead of the 8x8 list of strings
 isMuted = False
 IMAGES = {}
 
@@ -16,7 +26,7 @@ class ChessGame:
     def __init__(self):
         self.screen = None
         self.clock = None
-        self.gs = GameState()
+        self.gs = self.newGameState()
         self.validMoves = self.gs.getValidMoves()
         self.moveMade = False
         self.sqSelected = None  # tuple: (row, col)
@@ -24,6 +34,11 @@ class ChessGame:
         self.selectedPieceMoves = []  # Store valid moves for the selected piece
         self.capturedPieces = {"w": [], "b": []}  # Store captured pieces
         self.playerOne, self.playerTwo = None, None
+        self.searchWorker = SearchWorker()  # Runs the AI search in the background so the window stays responsive
+        self.book = OpeningBook(BOOK_PATH, BOOK_MAX_PLIES) if os.path.exists(BOOK_PATH) else None
+
+    def newGameState(self):
+        return BitboardGameState() if USE_BITBOARDS else GameState()
 
     def loadImages(self):
         pieces = ["wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"]
@@ -62,10 +77,18 @@ class ChessGame:
             if self.moveMade:
                 self.validMoves = self.gs.getValidMoves()
                 self.moveMade = False
+                humanTurn = (self.gs.whiteToMove and self.playerOne) or (not self.gs.whiteToMove and self.playerTwo)
+                if AI_PONDER and humanTurn and not (self.playerOne and self.playerTwo) and self.validMoves:
+                    self.searchWorker.ponder(self.gs, self.validMoves, AI_Depth)
             self.drawGameState()
             if self.gs.checkmate or self.gs.stalemate:
-                self.showEndGameMessage("Checkmate" if self.gs.checkmate else "Stalemate",
-                                        "Black" if self.gs.whiteToMove else "White")
+                if self.gs.checkmate:
+                    message = "Checkmate"
+                elif self.gs.repetitionCount() >= 3:
+                    message = "Threefold repetition"
+                else:
+                    message = "Stalemate"
+                self.showEndGameMessage(message, "Black" if self.gs.whiteToMove else "White")
                 running = False
             self.clock.tick(MAX_FPS)
             p.display.flip()
@@ -109,6 +132,7 @@ class ChessGame:
 
     def handleKeyPress(self, event):
         if event.key == p.K_z:
+            self.searchWorker.cancel()
             self.gs.undoMove()
             self.moveMade = True
         elif event.key == p.K_r:
@@ -200,10 +224,21 @@ class ChessGame:
     def handleAIMove(self):
         if not self.validMoves:
             return
-        AIMove = computer.findBestMoveAlphaBeta(self.gs, self.validMoves, AI_Depth)
-        if AIMove is None:
-            AIMove = computer.findRandomMove(self.validMoves)
-        self.gs.makeMove(AIMove)
+        bookMove = self.book.chooseMove(self.gs, self.validMoves) if self.book is not None else None
+        if bookMove is not None:  # Opening moves come straight from the book
+            self.searchWorker.cancel()
+            AIMove, choice = bookMove
+        else:
+            self.searchWorker.search(self.gs, AI_Depth, AI_TIME_LIMIT, AI_WORKERS)  # Does nothing if already searching
+            if not self.searchWorker.finished(self.gs):
+                return  # Still thinking, keep drawing frames
+            result = self.searchWorker.takeResult()
+            # The search ran on a copy of the game, so play the matching move from our own list
+            AIMove = next((move for move in self.validMoves if move == result.bestMove), None)
+            choice = result.choice
+            if AIMove is None:
+                AIMove, choice = computer.findRandomMove(self.validMoves), 'Q'
+        self.gs.makeMove(AIMove, choice)
         self.moveMade = True
         if not isMuted:
             if AIMove.pieceCaptured != "--":
@@ -213,7 +248,8 @@ class ChessGame:
                 p.mixer.Sound('sounds/move-self.mp3').play()
 
     def resetGame(self):
-        self.gs = GameState()
+        self.searchWorker.cancel()
+        self.gs = self.newGameState()
         self.validMoves = self.gs.getValidMoves()
         self.sqSelected = None
         self.playerClicks = []
@@ -576,6 +612,8 @@ class ChessGame:
         if winner:
             if message == "Checkmate":
                 message = f"{winner} wins by checkmate!"
+            elif message == "Threefold repetition":
+                message = "Draw by threefold repetition!"
             else:
                 message = "It's a stalemate!"
 
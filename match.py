@@ -0,0 +1,251 @@
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date
+import computer
+from pgn import moveToSan, formatGame
+from perft import START_FEN, newGameState
+from transposition import TranspositionTable
+
+MAX_PLIES = 400  # Games still running after this many plies are adjudicated a draw
+OPENING_PLIES = 4  # Random moves played from the start position before the engines take over
+HASH_MB = 4  # Transposition table of each engine in a game
+
+
+class EngineConfig:
+    """Search settings of one side of a match. materialWeight and positionalWeight scale the two evaluation terms"""
+
+    def __init__(self, name, depth=3, timeLimit=None, nodeLimit=None, materialWeight=1.0, positionalWeight=1.0):
+        self.name = name
+        self.depth = depth
+        self.timeLimit = timeLimit
+        self.nodeLimit = nodeLimit
+        self.materialWeight = materialWeight
+        self.positionalWeight = positionalWeight
+
+    def newSearch(self, seed=None):
+        search = computer.Search(TranspositionTable(HASH_MB), seed)
+        search.materialWeight, search.positionalWeight = self.materialWeight, self.positionalWeight
+        return search
+
+
+def parseConfig(text, name):
+    """An EngineConfig from "depth=3,time=0.5,nodes=20000,material=1.0,positional=0.5,name=tuned" """
+    settings = {}
+    for field in text.split(","):
+        if field:
+            key, _, value = field.partition("=")
+            settings[key.strip()] = value.strip()
+    return EngineConfig(settings.get("name", name), int(settings.get("depth", 3)),
+                        float(settings["time"]) if "time" in settings else None,
+                        int(settings["nodes"]) if "nodes" in settings else None,
+                        float(settings.get("material", 1.0)), float(settings.get("positional", 1.0)))
+
+
+def randomOpening(rng, plies):
+    """Coordinate notation of plies random legal moves from the start position"""
+    gs = newGameState(START_FEN, True)
+    opening = []
+    for _ in range(plies):
+        validMoves = gs.getValidMoves()
+        if not validMoves or gs.stalemate:
+            break
+        move = rng.choice(validMoves)
+        opening.append(move.getChessNotation())
+        gs.makeMove(move)
+    return opening
+
+
+def gameOutcome(gs, validMoves):
+    """(result, termination) once the game is over, None while it goes on. Call after gs.getValidMoves()"""
+    if gs.checkmate:
+        return ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+    if gs.stalemate:
+        if validMoves:
+            if gs.fiftyMoveCounter >= 50:
+                return "1/2-1/2", "fifty-move rule"
+            if gs.repetitionCount() >= 3:
+                return "1/2-1/2", "threefold repetition"
+            return "1/2-1/2", "insufficient material"
+        return "1/2-1/2", "stalemate"
+    if len(gs.moveLog) >= MAX_PLIES:
+        return "1/2-1/2", "adjudication"
+    return None
+
+
+def playGame(task):
+    """Runs in a worker: plays one game from the opening moves and returns (game number, PGN text, result,
+    plies, nodes searched)"""
+    number, white, black, opening, seed = task
+    gs = newGameState(START_FEN, True)
+    searches = {True: white.newSearch(seed), False: black.newSearch(seed)}
+    configs = {True: white, False: black}
+    sanMoves, nodes = [], 0
+    for notation in opening:
+        validMoves = gs.getValidMoves()
+        move = next(move for move in validMoves if move.getChessNotation() == notation)
+        sanMoves.append(moveToSan(gs, move, validMoves))
+        gs.makeMove(move)
+    while True:
+        validMoves = gs.getValidMoves()
+        outcome = gameOutcome(gs, validMoves)
+        if outcome is not None:
+            break
+        config = configs[gs.whiteToMove]
+        result = searches[gs.whiteToMove].run(gs, list(validMoves), config.depth, config.timeLimit, config.nodeLimit)
+        nodes += result.nodes
+        move, choice = (result.bestMove, result.choice) if result.bestMove is not None else (validMoves[0], 'Q')
+        sanMoves.append(moveToSan(gs, move, validMoves, choice))
+        gs.makeMove(move, choice)
+    result, termination = outcome
+    headers = {"Event": "Engine match", "Site": "PyChessGame", "Date": date.today().strftime("%Y.%m.%d"),
+               "Round": number, "White": white.name, "Black": black.name, "Result": result,
+               "PlyCount": len(gs.moveLog), "Termination": termination}
+    return number, formatGame(headers, sanMoves, result), result, len(gs.moveLog), nodes
+
+
+def eloFromScore(score):
+    """Elo difference that gives the stronger side an expected score of score (0 to 1)"""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def expectedScore(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class MatchStats:
+    """Wins, draws and losses of the first engine, with its Elo difference to the second and the log-likelihood
+    ratio of a sequential probability ratio test (SPRT) of elo1 against elo0"""
+
+    def __init__(self, elo0=0.0, elo1=10.0, alpha=0.05, beta=0.05):
+        self.wins, self.draws, self.losses = 0, 0, 0
+        self.elo0, self.elo1 = elo0, elo1
+        self.lowerBound = math.log(beta / (1 - alpha))  # LLR below this accepts elo0
+        self.upperBound = math.log((1 - beta) / alpha)  # LLR above this accepts elo1
+
+    def add(self, points):
+        if points == 1:
+            self.wins += 1
+        elif points == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        return (self.wins + self.draws / 2) / self.games() if self.games() else 0.5
+
+    def variance(self):
+        """Variance of the points of one game"""
+        games, score = self.games(), self.score()
+        if not games:
+            return 0.0
+        return (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2 + self.losses * score ** 2) / games
+
+    def elo(self):
+        """(Elo difference, 95% error margin)"""
+        games, score = self.games(), self.score()
+        if not games:
+            return 0.0, 0.0
+        margin = 1.96 * math.sqrt(self.variance() / games)
+        return eloFromScore(score), (eloFromScore(score + margin) - eloFromScore(score - margin)) / 2
+
+    def llr(self):
+        """Log-likelihood ratio of elo1 against elo0, with the normal approximation of the score"""
+        variance = self.variance()
+        if variance == 0:
+            return 0.0
+        s0, s1 = expectedScore(self.elo0), expectedScore(self.elo1)
+        return self.games() * (s1 - s0) * (2 * self.score() - s0 - s1) / (2 * variance)
+
+    def sprtResult(self):
+        """"H1" once elo1 is accepted, "H0" once elo0 is, None while the test goes on"""
+        llr = self.llr()
+        if llr >= self.upperBound:
+            return "H1"
+        if llr <= self.lowerBound:
+            return "H0"
+        return None
+
+    def summary(self):
+        elo, margin = self.elo()
+        return (f"+{self.wins} ={self.draws} -{self.losses} score {self.score():.3f} elo {elo:+.1f} +/- {margin:.1f} "
+                f"LLR {self.llr():.2f} [{self.lowerBound:.2f}, {self.upperBound:.2f}]")
+
+
+def gameTasks(engine1, engine2, games, openingPlies, seed):
+    """Games in pairs from the same random opening, engine1 playing white in the odd numbered ones"""
+    rng = random.Random(seed)
+    for number in range(1, games + 1):
+        if number % 2 == 1:
+            opening = randomOpening(rng, openingPlies)
+            white, black = engine1, engine2
+        else:
+            white, black = engine2, engine1
+        yield number, white, black, opening, rng.randrange(1 << 32)
+
+
+def runMatch(engine1, engine2, games, workers=None, pgnPath=None, openingPlies=OPENING_PLIES, sprt=None, seed=0):
+    """Plays games between engine1 and engine2 over a process pool, appending each finished game to pgnPath as it
+    comes in. sprt is (elo0, elo1, alpha, beta) to stop as soon as the test decides, or None to play every game.
+    Returns the MatchStats of engine1."""
+    stats = MatchStats(*sprt) if sprt is not None else MatchStats()
+    workers = workers or os.cpu_count() or 1
+    startTime = time.perf_counter()
+    plies, nodes = 0, 0
+    pgnFile = open(pgnPath, "a") if pgnPath is not None else None
+    pool = multiprocessing.Pool(workers)
+    try:
+        for number, text, result, gamePlies, gameNodes in \
+                pool.imap_unordered(playGame, gameTasks(engine1, engine2, games, openingPlies, seed)):
+            if pgnFile is not None:
+                pgnFile.write(text)
+                pgnFile.flush()
+            points = {"1-0": 1, "0-1": 0}.get(result, 0.5)
+            stats.add(points if number % 2 == 1 else 1 - points)
+            plies, nodes = plies + gamePlies, nodes + gameNodes
+            elapsed = time.perf_counter() - startTime
+            print(f"game {number} {result}: {stats.summary()} "
+                  f"({stats.games() / elapsed:.2f} games/s, {nodes / elapsed:.0f} nps)", flush=True)
+            if sprt is not None and stats.sprtResult() is not None:
+                print(f"SPRT accepts {stats.sprtResult()} after {stats.games()} games")
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+        if pgnFile is not None:
+            pgnFile.close()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play engine-vs-engine games between two search configurations")
+    parser.add_argument("--engine1", default="depth=3", help='settings such as "depth=3,time=1,nodes=50000,'
+                                                             'material=1.0,positional=1.0,name=new"')
+    parser.add_argument("--engine2", default="depth=2", help="settings of the opponent, as for --engine1")
+    parser.add_argument("--games", type=int, default=100, help="number of games, played in pairs swapping colours")
+    parser.add_argument("--workers", type=int, default=None, help="processes to play in, the number of CPUs by default")
+    parser.add_argument("--pgn", default=None, help="file to append the finished games to")
+    parser.add_argument("--opening-plies", type=int, default=OPENING_PLIES, help="random moves before the engines play")
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), default=None,
+                        help="stop once an SPRT of ELO1 against ELO0 decides")
+    parser.add_argument("--alpha", type=float, default=0.05, help="SPRT false positive rate")
+    parser.add_argument("--beta", type=float, default=0.05, help="SPRT false negative rate")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the openings and the engines' move shuffling")
+    args = parser.parse_args(argv)
+    engine1, engine2 = parseConfig(args.engine1, "engine1"), parseConfig(args.engine2, "engine2")
+    sprt = (args.sprt[0], args.sprt[1], args.alpha, args.beta) if args.sprt is not None else None
+    stats = runMatch(engine1, engine2, args.games, args.workers, args.pgn, args.opening_plies, sprt, args.seed)
+    print(f"{engine1.name} vs {engine2.name}: {stats.summary()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,176 +1,165 @@
+def _targetTable(steps):
+    """For every (row, col), the on-board squares one step away"""
+    return [[[(r + dr, c + dc) for dr, dc in steps if 0 <= r + dr < 8 and 0 <= c + dc < 8]
+             for c in range(8)] for r in range(8)]
+
+
+def _rayTable(directions):
+    """For every (row, col), a (direction, squares) pair per direction listing the squares out to the edge"""
+    table = [[[] for _ in range(8)] for _ in range(8)]
+    for r in range(8):
+        for c in range(8):
+            for d in directions:
+                ray = []
+                endRow, endCol = r + d[0], c + d[1]
+                while 0 <= endRow < 8 and 0 <= endCol < 8:
+                    ray.append((endRow, endCol))
+                    endRow, endCol = endRow + d[0], endCol + d[1]
+                table[r][c].append((d, ray))
+    return table
+
+
+# Built once at import so the generators don't redo the direction arithmetic and bounds checks for every piece
+KNIGHT_TARGETS = _targetTable(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_TARGETS = _targetTable(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# Squares a pawn attacks, white pawns attack up the board (towards row 0) and black pawns down
+PAWN_TARGETS = {'w': _targetTable(((-1, -1), (-1, 1))), 'b': _targetTable(((1, -1), (1, 1)))}
+ROOK_RAYS = _rayTable(((-1, 0), (0, -1), (1, 0), (0, 1)))
+BISHOP_RAYS = _rayTable(((-1, -1), (-1, 1), (1, 1), (1, -1)))
+# All eight directions, orthogonal ones first, in the order checkForPinsAndChecks relies on
+QUEEN_RAYS = _rayTable(((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)))
+
+
 class MoveGenerator:
-    
+    """Per-piece move generators mixed into GameState. self.pins maps each pinned square to the direction from
+    our king to the pinner, so a generator looks its piece up instead of searching and editing a list"""
+
     def getPawnMoves(self, r, c, moves, board, whiteToMove):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        
+        pinDirection = self.pins.get((r, c), ())
+        piecePinned = pinDirection != ()
+
         if whiteToMove:
             if board[r - 1][c] == "--":  # 1 square move
-                if not piecePinned or pinDirection == (-1, 0):
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)):
                     moves.append(Move((r, c), (r - 1, c), board))
                     if r == 6 and board[r-2][c] == "--":  # 2 square move
                         moves.append(Move((r, c), (r - 2, c), board))
             if c - 1 >= 0:  # Capture to the left
                 if board[r - 1][c - 1][0] == "b":
-                    if not piecePinned or pinDirection == (-1, -1):
+                    if not piecePinned or pinDirection in ((-1, -1), (1, 1)):
                         moves.append(Move((r, c), (r - 1, c - 1), board))
                 elif (r - 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c - 1), board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection in ((-1, -1), (1, 1))) and not self.enpassantExposesKing(r, c, c - 1, board, whiteToMove):
+                        moves.append(Move((r, c), (r - 1, c - 1), board, isEnpassantMove=True))
             if c + 1 < len(board):  # Capture to the right
                 if board[r - 1][c + 1][0] == "b":
-                    if not piecePinned or pinDirection == (-1, 1):
+                    if not piecePinned or pinDirection in ((-1, 1), (1, -1)):
                         moves.append(Move((r, c), (r - 1, c + 1), board))
                 elif (r - 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c + 1), board, isEnpassantMove=True))        
+                    if (not piecePinned or pinDirection in ((-1, 1), (1, -1))) and not self.enpassantExposesKing(r, c, c + 1, board, whiteToMove):
+                        moves.append(Move((r, c), (r - 1, c + 1), board, isEnpassantMove=True))        
                 
         else:
             if board[r + 1][c] == "--":  # 1 square move
-                if not piecePinned or pinDirection == (1, 0):
+                if not piecePinned or pinDirection in ((1, 0), (-1, 0)):
                     moves.append(Move((r, c), (r + 1, c), board))
                     if r == 1 and board[r+2][c] == "--":  # 2 square move
                         moves.append(Move((r, c), (r + 2, c), board))
             if c - 1 >= 0:  # Capture to the left
                 if board[r + 1][c - 1][0] == "w":
-                    if not piecePinned or pinDirection == (1, -1):
+                    if not piecePinned or pinDirection in ((1, -1), (-1, 1)):
                         moves.append(Move((r, c), (r + 1, c - 1), board))
                 elif (r + 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c - 1), board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection in ((1, -1), (-1, 1))) and not self.enpassantExposesKing(r, c, c - 1, board, whiteToMove):
+                        moves.append(Move((r, c), (r + 1, c - 1), board, isEnpassantMove=True))
             if c + 1 < len(board):  # Capture to the right
                 if board[r + 1][c + 1][0] == "w":
-                    if not piecePinned or pinDirection == (1, 1):
+                    if not piecePinned or pinDirection in ((1, 1), (-1, -1)):
                         moves.append(Move((r, c), (r + 1, c + 1), board))
                 elif (r + 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c + 1), board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection in ((1, 1), (-1, -1))) and not self.enpassantExposesKing(r, c, c + 1, board, whiteToMove):
+                        moves.append(Move((r, c), (r + 1, c + 1), board, isEnpassantMove=True))
         # TODO: Add pawn promotion      
 
+    def enpassantExposesKing(self, r, c, captureCol, board, whiteToMove):
+        """En passant lifts two pawns off the same row, which can open that row onto our king"""
+        kingRow, kingCol = self.whiteKingLocation if whiteToMove else self.blackKingLocation
+        if kingRow != r:
+            return False
+        opponent = 'b' if whiteToMove else 'w'
+        step = 1 if kingCol < c else -1
+        col = kingCol + step
+        while 0 <= col < len(board):
+            if col != c and col != captureCol:
+                piece = board[r][col]
+                if piece != "--":
+                    return piece[0] == opponent and piece[1] in ('R', 'Q')
+            col += step
+        return False
+
     def getRookMoves(self, r, c, moves, board, whiteToMove):
         """Gets all rook moves for the rook located at (r, c) and adds moves to move log"""
         opponent = 'b' if whiteToMove else 'w'
 
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if board[r][c][1] != 'Q':  # Can't remove queen from pin on rook moves (only bishop moves)
-                    self.pins.remove(self.pins[i])
-                break
-
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1)]  # Tuples indicate (row, column) movements possible
-        for d in directions:
-            for i in range(1, len(board)):
-                endRow = r + d[0] * i  # Potentially moves up/down to 7 rows
-                endCol = c + d[1] * i  # Potentially moves up/down to 7 columns
-                if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):  # Makes sure on the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = board[endRow][endCol]
-                        if endPiece == '--':  # Valid move to empty space
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                        elif endPiece[0] == opponent:  # Valid move to capture
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                            break
-                        else:  # Cannot take friendly piece
-                            break
-                else:  # Cannot move off board
-                    break
+        pinDirection = self.pins.get((r, c), ())
+        piecePinned = pinDirection != ()
 
-    def getKnightMoves(self, r, c, moves, board, whiteToMove):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))  # L-shaped moves
-        allyColor = "w" if whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):
-                if not piecePinned or pinDirection == (m[0], m[1]) or pinDirection == (-m[0], -m[1]):
+        self.getSlidingMoves(r, c, moves, board, opponent, ROOK_RAYS[r][c], piecePinned, pinDirection)
+
+    def getSlidingMoves(self, r, c, moves, board, opponent, rays, piecePinned, pinDirection):
+        """Walks each precomputed ray from (r, c) until it leaves the board, hits a piece or captures one"""
+        for d, ray in rays:
+            if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
+                for endRow, endCol in ray:
                     endPiece = board[endRow][endCol]
-                    if endPiece == "--" or endPiece[0] != allyColor:
+                    if endPiece == '--':  # Valid move to empty space
+                        moves.append(Move((r, c), (endRow, endCol), board))
+                    elif endPiece[0] == opponent:  # Valid move to capture
                         moves.append(Move((r, c), (endRow, endCol), board))
+                        break
+                    else:  # Cannot take friendly piece
+                        break
+
+    def getKnightMoves(self, r, c, moves, board, whiteToMove):
+        if (r, c) in self.pins:  # A knight never moves along its pin line
+            return
+        allyColor = "w" if whiteToMove else "b"
+        for endRow, endCol in KNIGHT_TARGETS[r][c]:
+            endPiece = board[endRow][endCol]
+            if endPiece == "--" or endPiece[0] != allyColor:
+                moves.append(Move((r, c), (endRow, endCol), board))
         
     def getBishopMoves(self, r, c, moves, board, whiteToMove):
         """Gets all bishop moves for the bishop located at (r, c) and adds moves to move log"""
         opponent = 'b' if whiteToMove else 'w'
 
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = [(-1, -1), (-1, 1), (1, 1), (1, -1)]  # Tuples indicate (row, column) movements possible
-        for d in directions:
-            for i in range(1, len(board)):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-
-                if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):  # Makes sure on the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = board[endRow][endCol]
-                        if endPiece == '--':  # Valid move to empty space
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                        elif endPiece[0] == opponent:  # Valid move to capture
-                            moves.append(Move((r, c), (endRow, endCol), board))
-                            break
-                        else:  # Cannot take friendly piece
-                            break
-                else:  # Cannot move off board
-                    break
+        pinDirection = self.pins.get((r, c), ())
+        piecePinned = pinDirection != ()
+
+        self.getSlidingMoves(r, c, moves, board, opponent, BISHOP_RAYS[r][c], piecePinned, pinDirection)
         
     def getQueenMoves(self, r, c, moves, board, whiteToMove):
         self.getRookMoves(r, c, moves, board, whiteToMove)
         self.getBishopMoves(r, c, moves, board, whiteToMove)
 
     def getKingMoves(self, r, c, moves, board, whiteToMove):
-        kingMoves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))  # All possible king moves
+        """King steps to squares missing from self.enemyAttacks, the attack map getValidMoves builds first"""
         allyColor = "w" if whiteToMove else "b"
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                self.pins.remove(self.pins[i])
-                break
-        for m in kingMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < len(board) and 0 <= endCol < len(board[0]):
-                endPiece = board[endRow][endCol]
-                if endPiece == "--" or endPiece[0] != allyColor:
-                    # Place king on end square and check for checks
-                    if whiteToMove:
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r, c), (endRow, endCol), board))
-                    # Place king back on original location
-                    if whiteToMove:
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        for endRow, endCol in KING_TARGETS[r][c]:
+            endPiece = board[endRow][endCol]
+            if (endPiece == "--" or endPiece[0] != allyColor) and (endRow, endCol) not in self.enemyAttacks:
+                moves.append(Move((r, c), (endRow, endCol), board))
     
     def getCastleMoves(self, r, c, moves, board, whiteToMove):
-        if self.squareUnderAttack(r, c):
-            return # Can't castle while in check
-        if (self.whiteToMove and self.currentCastleRights.wks) or (not self.whiteToMove and self.currentCastleRights.bks):
+        if whiteToMove:
+            kingside, queenside = self.currentCastleRights.wks, self.currentCastleRights.wqs
+        else:
+            kingside, queenside = self.currentCastleRights.bks, self.currentCastleRights.bqs
+        if not (kingside or queenside) or self.inCheck:
+            return # No rights left, or can't castle while in check
+        if kingside:
             self.getKingsideCastleMoves(r, c, moves, board, whiteToMove)
-        if (self.whiteToMove and self.currentCastleRights.wqs) or (not self.whiteToMove and self.currentCastleRights.bqs):
+        if queenside:
             self.getQueensideCastleMoves(r, c, moves, board, whiteToMove)
     
     def getKingsideCastleMoves(self, r, c, moves, board, whiteToMove):
@@ -188,33 +177,92 @@ class CastleRights:
     def __init__(self, wks, bks, wqs, bqs):
         self.wks, self.bks, self.wqs, self.bqs = wks, bks, wqs, bqs 
 
+# Piece codes used inside a packed Move, 0 is an empty square
+PIECE_CODES = {"--": 0, "wp": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+               "bp": 7, "bN": 8, "bB": 9, "bR": 10, "bQ": 11, "bK": 12}
+PIECE_NAMES = ["--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+ENPASSANT_FLAG, CASTLE_FLAG, PROMOTION_FLAG = 1 << 20, 1 << 21, 1 << 22
+SQUARES_MASK = (1 << 12) - 1
+
 class Move():
+    """A move packed into one integer: bits 0-5 hold the start square and 6-11 the end square (row * 8 + col),
+    12-15 the piece moved and 16-19 the piece captured (PIECE_CODES), then the en passant, castle and promotion
+    flags. The familiar attributes are decoded from it when read."""
+    __slots__ = ("packed",)
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
     
     def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPawnPromotion = (self.pieceMoved == "wp" and self.endRow == 0) or (self.pieceMoved == "bp" and self.endRow == 7)
-        self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = "wp" if self.pieceMoved == "bp" else "bp"
-        # Castle move
-        self.isCastleMove = isCastleMove
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        pieceMoved = board[startRow][startCol]
+        if isEnpassantMove:
+            pieceCaptured = "wp" if pieceMoved == "bp" else "bp"
+        else:
+            pieceCaptured = board[endRow][endCol]
+        packed = (startRow * 8 + startCol) | (endRow * 8 + endCol) << 6 | \
+            PIECE_CODES[pieceMoved] << 12 | PIECE_CODES[pieceCaptured] << 16
+        if isEnpassantMove:
+            packed |= ENPASSANT_FLAG
+        if isCastleMove:
+            packed |= CASTLE_FLAG
+        if (pieceMoved == "wp" and endRow == 0) or (pieceMoved == "bp" and endRow == 7):
+            packed |= PROMOTION_FLAG
+        self.packed = packed
+
+    @property
+    def startRow(self):
+        return (self.packed >> 3) & 7
+
+    @property
+    def startCol(self):
+        return self.packed & 7
+
+    @property
+    def endRow(self):
+        return (self.packed >> 9) & 7
+
+    @property
+    def endCol(self):
+        return (self.packed >> 6) & 7
+
+    @property
+    def pieceMoved(self):
+        return PIECE_NAMES[(self.packed >> 12) & 15]
+
+    @property
+    def pieceCaptured(self):
+        return PIECE_NAMES[(self.packed >> 16) & 15]
+
+    @property
+    def isEnpassantMove(self):
+        return self.packed & ENPASSANT_FLAG != 0
+
+    @property
+    def isCastleMove(self):
+        return self.packed & CASTLE_FLAG != 0
+
+    @property
+    def isPawnPromotion(self):
+        return self.packed & PROMOTION_FLAG != 0
+
+    @property
+    def moveID(self):
+        packed = self.packed
+        return ((packed >> 3) & 7) * 1000 + (packed & 7) * 100 + ((packed >> 9) & 7) * 10 + ((packed >> 6) & 7)
+
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            # Same start and end squares, exactly when the moveIDs are equal
+            return self.packed & SQUARES_MASK == other.packed & SQUARES_MASK
+
+    def __hash__(self):
+        return self.packed & SQUARES_MASK
         
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
     
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
\ No newline at end of file
+        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
@@ -0,0 +1,171 @@
+import argparse
+import atexit
+import multiprocessing
+import os
+import sys
+import time
+import computer
+from computer import CHECKMATE, SearchTimeout
+from transposition import TranspositionTable
+
+pool = None
+poolWorkers = 0
+sharedBound = None  # Best root score found so far in this iteration, from the side to move's point of view
+stopEvent = None  # Set by ParallelSearch.stop, every worker's search checks it along with its clock
+searchID = 0
+lastSearch = None  # Result of the last findBestMoveParallel call
+workerSearch = None  # In a worker: its own Search, with its own transposition table, kept between tasks
+workerSearchID = None  # In a worker: the search its killer moves, history and table generation belong to
+
+
+def initWorker(bound, stop):
+    global sharedBound, stopEvent, workerSearch
+    sharedBound, stopEvent = bound, stop
+    workerSearch = computer.Search()
+    workerSearch.stopEvent = stop
+
+
+def getPool(workers=None):
+    """The process pool for the given worker count, started once and reused by later searches"""
+    global pool, poolWorkers, sharedBound, stopEvent
+    workers = workers or os.cpu_count() or 1
+    if pool is None or poolWorkers != workers:
+        shutdownPool()
+        sharedBound = multiprocessing.Value('d', -CHECKMATE)
+        stopEvent = multiprocessing.Event()
+        pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(sharedBound, stopEvent))
+        poolWorkers = workers
+    return pool
+
+
+def shutdownPool():
+    global pool, poolWorkers
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+    pool, poolWorkers = None, 0
+
+
+atexit.register(shutdownPool)
+
+
+def searchRootMove(gs, move, depth, maxDepth, deadline, rootSearchID):
+    """Runs in a worker: plays move on its own copy of gs and searches the reply depth - 1 plies deep.
+    Alpha-beta starts from the best root score any worker has reported, and the result raises it for the
+    others. Returns (score, alpha it was searched with, nodes, principal variation from move on), or None if
+    the search was stopped or deadline (a time.time() shared by every task of the iteration) has passed."""
+    global workerSearchID
+    if stopEvent.is_set() or (deadline is not None and time.time() >= deadline):
+        return None  # Queued behind the others until the time ran out
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    if workerSearchID != rootSearchID:
+        workerSearchID = rootSearchID
+        workerSearch.reset(maxDepth)
+    nodesBefore = workerSearch.nodes
+    # time.time() reads the same in every process, the search itself times against perf_counter
+    workerSearch.deadline = time.perf_counter() + (deadline - time.time()) if deadline is not None else None
+    alphaUsed = sharedBound.value
+    if turnMultiplier == 1:
+        alpha, beta = alphaUsed, CHECKMATE
+    else:
+        alpha, beta = -CHECKMATE, -alphaUsed
+    gs.makeMove(move)
+    try:
+        score = workerSearch.alphaBeta(gs, None, depth - 1, 1, alpha, beta, -turnMultiplier)
+    except SearchTimeout:
+        return None
+    finally:
+        workerSearch.deadline = None
+    with sharedBound.get_lock():
+        if score * turnMultiplier > sharedBound.value:
+            sharedBound.value = score * turnMultiplier
+    pv = [move] + workerSearch.principalVariation(gs, None, depth - 1)
+    return score, alphaUsed, workerSearch.nodes - nodesBefore, pv
+
+
+class ParallelSearch(computer.Search):
+    """computer.Search with the root moves of every iteration spread over the process pool. Each iteration searches
+    the previous best move first to set a bound, then the rest in parallel, each worker on its own copy of the game
+    with its own transposition table. stop() reaches the workers through stopEvent and ends the search at once,
+    and deadline (perf_counter) may be moved while it runs. A nodeLimit is only checked between iterations."""
+
+    def __init__(self, workers=None, seed=None):
+        super().__init__(TranspositionTable(0), seed)  # Only the workers search, the root needs no table
+        self.workers = workers  # Defaults to the number of CPUs
+        self.pool = None
+
+    def stop(self):
+        self.stopped = True
+        if stopEvent is not None:
+            stopEvent.set()
+
+    def run(self, gs, validMoves, maxDepth, timeLimit=None, nodeLimit=None):
+        global searchID
+        self.pool = getPool(self.workers)
+        if not self.stopped:
+            stopEvent.clear()
+        searchID += 1
+        return super().run(gs, validMoves, maxDepth, timeLimit, nodeLimit)
+
+    def searchRoot(self, gs, validMoves, depth, maxDepth):
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        # One absolute deadline for every task of the iteration, however long it waits in the queue
+        deadline = time.time() + (self.deadline - time.perf_counter()) if self.deadline is not None else None
+        sharedBound.value = -CHECKMATE
+        first = self.pool.apply(searchRootMove, (gs, validMoves[0], depth, maxDepth, deadline, searchID))
+        if first is None or self.stopped:
+            raise SearchTimeout()
+        rest = self.pool.starmap(searchRootMove, [(gs, move, depth, maxDepth, deadline, searchID)
+                                                  for move in validMoves[1:]], chunksize=1)
+        results = [first] + rest
+        self.nodes += sum(searched[2] for searched in results if searched is not None)
+        if None in results:
+            raise SearchTimeout()  # Out of time, keep the move from the last complete iteration
+        best = first
+        for searched in results:
+            score, alphaUsed = searched[0], searched[1]
+            # A score at or below the bound it was searched with only says the move is no better than that bound
+            if score * turnMultiplier > alphaUsed and score * turnMultiplier > best[0] * turnMultiplier:
+                best = searched
+        bestMove = validMoves[results.index(best)]
+        return bestMove, best[0], [bestMove] + best[3][1:]
+
+
+def findBestMoveParallel(gs, validMoves, AIDepth=0, timeLimit=None, workers=None):
+    """findBestMoveAlphaBeta on a ParallelSearch; workers defaults to the number of CPUs"""
+    global lastSearch
+    lastSearch = ParallelSearch(workers).run(gs, validMoves, AIDepth, timeLimit)
+    return lastSearch.bestMove
+
+
+def benchmark(fen, depth, workerCounts):
+    """Times a fixed-depth search serially and with each worker count, printing the speedup over serial"""
+    from perft import newGameState
+    gs = newGameState(fen, True)
+    serial = computer.Search(seed=0).run(gs, gs.getValidMoves(), depth)
+    print(f"serial: {serial.bestMove.getChessNotation()} {serial.nodes} nodes in {serial.time:.3f}s "
+          f"({serial.nodes / max(serial.time, 1e-9):.0f} nps)")
+    for workers in workerCounts:
+        getPool(workers)  # Start the processes before the clock does
+        result = ParallelSearch(workers, 0).run(gs, gs.getValidMoves(), depth)
+        print(f"{workers} workers: {result.bestMove.getChessNotation()} {result.nodes} nodes in {result.time:.3f}s "
+              f"({result.nodes / max(result.time, 1e-9):.0f} nps), speedup {serial.time / max(result.time, 1e-9):.2f}x")
+        shutdownPool()
+
+
+def main(argv=None):
+    from perft import START_FEN
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Measure how the parallel root search scales with worker count")
+    parser.add_argument("--fen", default=START_FEN, help="position to search, the start position by default")
+    parser.add_argument("--depth", type=int, default=4, help="search depth in plies")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({n for n in (1, 2, 4, cpus) if n <= cpus}),
+                        help="worker counts to time")
+    args = parser.parse_args(argv)
+    benchmark(args.fen, args.depth, args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import sys
+import time
+from engine import GameState
+from bitboard import BitboardGameState
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+PROMOTION_CHOICES = ('Q', 'R', 'B', 'N')
+
+# Standard perft positions with their known node counts for depth 1, 2, 3, ...
+REFERENCE_POSITIONS = [
+    ("Start position", START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("Position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("Position 4 mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("Position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(gs, depth):
+    """Counts the leaf nodes of the legal move tree, each promotion counting once per piece it can become"""
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return sum(4 if move.isPawnPromotion else 1 for move in moves)
+    nodes = 0
+    for move in moves:
+        for choice in PROMOTION_CHOICES if move.isPawnPromotion else ('Q',):
+            gs.makeMove(move, choice)
+            nodes += perft(gs, depth - 1)
+            gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """Perft split by root move, as a list of (move notation, nodes)"""
+    results = []
+    for move in gs.getValidMoves():
+        for choice in PROMOTION_CHOICES if move.isPawnPromotion else ('Q',):
+            notation = move.getChessNotation() + (choice.lower() if move.isPawnPromotion else '')
+            gs.makeMove(move, choice)
+            results.append((notation, perft(gs, depth - 1) if depth > 1 else 1))
+            gs.undoMove()
+    return results
+
+
+def newGameState(fen, bitboards):
+    return BitboardGameState(fen) if bitboards else GameState(fen)
+
+
+def runPerft(fen, maxDepth, bitboards, showDivide):
+    gs = newGameState(fen, bitboards)
+    for depth in range(1, maxDepth + 1):
+        startTime = time.perf_counter()
+        if showDivide and depth == maxDepth:
+            results = divide(gs, depth)
+            for notation, nodes in results:
+                print(f"  {notation}: {nodes}")
+            nodes = sum(nodes for _, nodes in results)
+        else:
+            nodes = perft(gs, depth)
+        elapsed = time.perf_counter() - startTime
+        print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nodes / max(elapsed, 1e-9):.0f} nps)")
+
+
+def runSuite(maxDepth, maxNodes, bitboards):
+    """Checks every reference position up to maxDepth, skipping depths with more than maxNodes leaves"""
+    failures = 0
+    totalNodes, totalTime = 0, 0.0
+    for name, fen, expectedCounts in REFERENCE_POSITIONS:
+        gs = newGameState(fen, bitboards)
+        for depth, expected in enumerate(expectedCounts[:maxDepth], 1):
+            if expected > maxNodes:
+                break
+            startTime = time.perf_counter()
+            nodes = perft(gs, depth)
+            elapsed = time.perf_counter() - startTime
+            totalNodes += nodes
+            totalTime += elapsed
+            status = "ok" if nodes == expected else f"FAIL (expected {expected})"
+            if nodes != expected:
+                failures += 1
+            print(f"{name}, depth {depth}: {nodes} nodes in {elapsed:.3f}s "
+                  f"({nodes / max(elapsed, 1e-9):.0f} nps) {status}")
+    print(f"{totalNodes} nodes in {totalTime:.3f}s ({totalNodes / max(totalTime, 1e-9):.0f} nps), {failures} failures")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count and time legal move trees (perft) for the move generator")
+    parser.add_argument("--fen", default=START_FEN, help="position to search, the start position by default")
+    parser.add_argument("--depth", type=int, default=3, help="deepest ply to count")
+    parser.add_argument("--divide", action="store_true", help="list the node count of every root move")
+    parser.add_argument("--suite", action="store_true", help="check the reference positions instead of --fen")
+    parser.add_argument("--max-nodes", type=int, default=1000000,
+                        help="with --suite, skip depths whose expected count is larger than this")
+    parser.add_argument("--bitboard", action="store_true", help="use BitboardGameState instead of GameState")
+    args = parser.parse_args(argv)
+    if args.suite:
+        return 1 if runSuite(args.depth, args.max_nodes, args.bitboard) else 0
+    runPerft(args.fen, args.depth, args.bitboard, args.divide)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import argparse
+import io
+import re
+import sys
+import time
+from moves import Move
+from perft import START_FEN, newGameState
+
+LINE_LENGTH = 80  # PGN export format keeps movetext lines at most this long
+TAG_ORDER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")  # The seven tag roster comes first
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# A brace comment (or the start of one running on to later lines), a rest-of-line comment, a variation bracket,
+# or a run of other characters: a move, move number, NAG or result
+TOKEN = re.compile(r"\{[^}]*\}|\{.*|;.*|[()]|[^\s{}();]+")
+MOVE_NUMBER = re.compile(r"^\d+\.+")
+SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+# Put after the moves of a game whose comment or variation is still open when the game ends, so it fails to replay
+UNTERMINATED = "<comment or variation left open>"
+# Broken games readGames has to get past without swallowing the games after them: (PGN text, games in it, games
+# that replay)
+REGRESSION_CASES = [
+    ('[Event "open variation"]\n\n1. e4 e5 2. Nf3 (2. Nc3 Nc6 1-0\n\n'
+     '[Event "next"]\n\n1. f3 e5 2. g4 Qh4# 0-1\n', 2, 1),
+    ('[Event "open comment"]\n\n1. e4 {never closed\n1. d4 *\n\n'
+     '[Event "next"]\n\n1. d4 d5 *\n', 2, 1),
+    ('[Event "open variation at the end"]\n\n1. e4 (1. d4 d5\n', 1, 0),
+    ('[Event "comment with a clock"]\n\n1. e4 {\n[%clk 0:03:00] } e5 *\n', 1, 1),
+]
+
+
+class PgnError(ValueError):
+    """A game whose tags or moves can't be read or played"""
+
+
+def moveToSan(gs, move, validMoves, choice='Q'):
+    """Standard algebraic notation of move, one of validMoves in gs, e.g. Nbd7, exd6, e8=Q+ or O-O#"""
+    if move.isCastleMove:
+        san = "O-O" if move.endCol == 6 else "O-O-O"
+    else:
+        pieceType = move.pieceMoved[1]
+        target = move.getRankFile(move.endRow, move.endCol)
+        capture = "x" if move.pieceCaptured != "--" else ""
+        if pieceType == 'p':
+            san = (move.colsToFiles[move.startCol] + capture if capture else "") + target
+            if move.isPawnPromotion:
+                san += "=" + choice
+        else:
+            # Name the start file, rank or both if another piece of the same kind can reach the same square
+            rivals = [other for other in validMoves if other.pieceMoved == move.pieceMoved and other != move
+                      and (other.endRow, other.endCol) == (move.endRow, move.endCol)]
+            disambiguation = ""
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    disambiguation = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    disambiguation = move.rowsToRanks[move.startRow]
+                else:
+                    disambiguation = move.getRankFile(move.startRow, move.startCol)
+            san = pieceType + disambiguation + capture + target
+    gs.makeMove(move, choice)
+    if not gs.hasLegalMove():  # Also brings gs.inCheck up to date
+        san += "#" if gs.inCheck else ""
+    elif gs.inCheck:
+        san += "+"
+    gs.undoMove()
+    return san
+
+
+def formatGame(headers, sanMoves, result, firstMoveNumber=1, blackToMoveFirst=False, annotations=None):
+    """A game as PGN text: headers (tag -> value, the seven tag roster first), then the movetext wrapped to
+    LINE_LENGTH and ended by result. A game from a FEN where black moves first starts with "N..." .
+    annotations, if given, holds for every move a list of NAGs and comments ("$4", "{text}") to put after it."""
+    tags = [tag for tag in TAG_ORDER if tag in headers] + [tag for tag in headers if tag not in TAG_ORDER]
+    lines = ['[%s "%s"]' % (tag, str(headers[tag]).replace("\\", "\\\\").replace('"', '\\"')) for tag in tags]
+    tokens = []
+    moveNumber, whiteToMove = firstMoveNumber, not blackToMoveFirst
+    for i, san in enumerate(sanMoves):
+        if whiteToMove:
+            tokens.append(f"{moveNumber}.")
+        elif i == 0 or (annotations is not None and annotations[i - 1]):  # Black's move number again after a comment
+            tokens.append(f"{moveNumber}...")
+        tokens.append(san)
+        if annotations is not None:
+            tokens.extend(annotations[i])
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(result)
+    movetext, line = [], ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            movetext.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    movetext.append(line)
+    return "\n".join(lines) + "\n\n" + "\n".join(movetext) + "\n\n"
+
+
+def readGames(lines):
+    """Yields (headers, SAN moves, result) for each game in lines (e.g. an open file), reading one line at a time,
+    so memory use depends only on the longest game. Comments, variations, NAGs and move numbers are dropped,
+    and check, mate and annotation marks are left on the moves. A game whose comment or variation is still open
+    at its result or at the next game's tags ends there, with UNTERMINATED after its moves."""
+    headers, sanMoves = {}, []
+    inComment, variationDepth = False, 0
+    for line in lines:
+        if (inComment or variationDepth > 0) and TAG.match(line.strip().lstrip("\ufeff")):
+            sanMoves.append(UNTERMINATED)  # The tags of the next game, this one never closed its comment or variation
+            yield headers, sanMoves, headers.get("Result", "*")
+            headers, sanMoves, inComment, variationDepth = {}, [], False, 0
+        if inComment:
+            end = line.find("}")
+            if end < 0:
+                continue
+            line, inComment = line[end + 1:], False
+        stripped = line.strip().lstrip("\ufeff")
+        if not stripped or stripped.startswith("%"):
+            continue
+        if stripped.startswith("[") and variationDepth == 0:
+            if sanMoves:  # Tags of the next game, this one had no result
+                yield headers, sanMoves, headers.get("Result", "*")
+                headers, sanMoves = {}, []
+            tag = TAG.match(stripped)
+            if tag is not None:
+                headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+        for token in TOKEN.findall(line):
+            first = token[0]
+            if first == "{":
+                inComment = not token.endswith("}")
+            elif first == ";":
+                pass
+            elif first == "(":
+                variationDepth += 1
+            elif first == ")":
+                variationDepth = max(variationDepth - 1, 0)
+            elif token in RESULTS:  # Ends the game even inside a variation, as a variation never holds a result
+                if variationDepth > 0:
+                    sanMoves.append(UNTERMINATED)
+                yield headers, sanMoves, token
+                headers, sanMoves, variationDepth = {}, [], 0
+            elif variationDepth > 0 or first == "$":
+                pass
+            else:
+                token = MOVE_NUMBER.sub("", token)
+                if token:
+                    sanMoves.append(token)
+    if headers or sanMoves:
+        if inComment or variationDepth > 0:
+            sanMoves.append(UNTERMINATED)
+        yield headers, sanMoves, headers.get("Result", "*")
+
+
+def sanToMove(gs, san, validMoves):
+    """The (move, promotion choice) of validMoves in gs that san stands for. Raises PgnError if it is not
+    exactly one of them."""
+    if san == UNTERMINATED:
+        raise PgnError("comment or variation left open")
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(text) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move, 'Q'
+        raise PgnError(f"illegal castling {san}")
+    parsed = SAN.match(text)
+    if parsed is None:
+        raise PgnError(f"unreadable move {san}")
+    pieceType, fromFile, fromRank, target, promotion = parsed.groups()
+    pieceType = pieceType or 'p'
+    endRow, endCol = Move.ranksToRows[target[1]], Move.filesToCols[target[0]]
+    startRow = Move.ranksToRows[fromRank] if fromRank is not None else None
+    startCol = Move.filesToCols[fromFile] if fromFile is not None else None
+    matches = [move for move in validMoves if move.endRow == endRow and move.endCol == endCol
+               and move.pieceMoved[1] == pieceType and not move.isCastleMove
+               and (startCol is None or move.startCol == startCol) and (startRow is None or move.startRow == startRow)]
+    if len(matches) != 1:
+        raise PgnError(f"{'ambiguous' if matches else 'illegal'} move {san}")
+    move = matches[0]
+    if move.isPawnPromotion != (promotion is not None):
+        raise PgnError(f"promotion piece missing or misplaced in {san}")
+    return move, promotion or 'Q'
+
+
+def replayGame(headers, sanMoves, bitboards=True):
+    """Plays a game read by readGames through makeMove, from its FEN tag if it has one. Returns the final
+    GameState and the (move, promotion choice) of every ply, or raises PgnError."""
+    try:
+        gs = newGameState(headers.get("FEN", START_FEN), bitboards)
+    except (ValueError, KeyError, IndexError):
+        raise PgnError(f"bad FEN tag {headers.get('FEN')}")
+    moves = []
+    try:
+        for san in sanMoves:
+            move, choice = sanToMove(gs, san, gs.getValidMoves())
+            gs.makeMove(move, choice)
+            moves.append((move, choice))
+    except (KeyError, IndexError) as error:  # A position the move generators can't handle, e.g. from a bad FEN tag
+        raise PgnError(f"unplayable position after {len(moves)} moves: {error!r}")
+    return gs, moves
+
+
+def replayFile(path, bitboards=True, progressEvery=1000):
+    """Replays every game in path, skipping (and counting) the ones that can't be played.
+    Returns (games replayed, games skipped, plies, seconds)."""
+    games, skipped, plies = 0, 0, 0
+    startTime = time.perf_counter()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for headers, sanMoves, _ in readGames(f):
+            try:
+                _, moves = replayGame(headers, sanMoves, bitboards)
+            except PgnError as error:
+                skipped += 1
+                print(f"skipped game {games + skipped}: {error}", file=sys.stderr)
+                continue
+            games += 1
+            plies += len(moves)
+            if progressEvery and games % progressEvery == 0:
+                printRate(games, skipped, plies, time.perf_counter() - startTime)
+    seconds = time.perf_counter() - startTime
+    printRate(games, skipped, plies, seconds)
+    return games, skipped, plies, seconds
+
+
+def runRegression():
+    """Reads and replays every REGRESSION_CASES game, printing each result. Returns the number of failures"""
+    failures = 0
+    for text, expectedGames, expectedPlayable in REGRESSION_CASES:
+        games, playable = 0, 0
+        for headers, sanMoves, _ in readGames(io.StringIO(text)):
+            games += 1
+            try:
+                replayGame(headers, sanMoves)
+                playable += 1
+            except PgnError:
+                pass
+        ok = (games, playable) == (expectedGames, expectedPlayable)
+        failures += not ok
+        print(f"{text.splitlines()[0]}: {games} games, {playable} playable {'ok' if ok else 'FAILED'}")
+    return failures
+
+
+def printRate(games, skipped, plies, seconds):
+    seconds = max(seconds, 1e-9)
+    print(f"{games} games ({skipped} skipped), {plies} plies in {seconds:.1f}s: "
+          f"{games / seconds:.1f} games/s, {plies / seconds:.0f} plies/s", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file through GameState")
+    parser.add_argument("path", nargs="?", help="PGN file to read")
+    parser.add_argument("--list", action="store_true", help="use the 8x8 list GameState instead of bitboards")
+    parser.add_argument("--progress", type=int, default=1000, help="print the rate every this many games, 0 never")
+    parser.add_argument("--regression", action="store_true", help="check the reader against REGRESSION_CASES")
+    args = parser.parse_args(argv)
+    if args.regression:
+        return 1 if runRegression() else 0
+    if args.path is None:
+        parser.error("a PGN file is needed unless --regression is given")
+    replayFile(args.path, not args.list, args.progress)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
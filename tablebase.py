@@ -0,0 +1,235 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from bitboard import SQUARE_BITS, KING_ATTACKS, PAWN_ATTACKS, rookAttacks, bishopAttacks, squares
+
+# Endgames of a king and one piece against a bare king. Positions are stored with the strong side as white, an
+# index per (side to move, strong king, weak king, piece) and squares numbered row * 8 + col like GameState.board.
+# Entries hold 0 for a draw (or an impossible position), otherwise 1 + the number of plies to mate with best play.
+ENDINGS = ("KQK", "KRK", "KPK")  # KPK last, its promotions are looked up in the other two
+TABLEBASE_DIR = "tablebases"
+MAGIC = b"PYTB"
+HEADER_SIZE = 8  # MAGIC, bits per entry, 3 spare bytes
+POSITIONS = 2 * 64 * 64 * 64
+STRONG, WEAK = 0, 1  # Side to move
+CAPTURE = 255  # Move count of a position where the weak king can take the piece, so it is never lost
+tables = {}  # ending -> Tablebase, for every file found by loadTables
+PROMOTION_CHOICES = ('Q', 'R', 'B', 'N')  # Queen first, so it is kept when an underpromotion does no better
+
+
+def index(sideToMove, strongKing, weakKing, piece):
+    return ((sideToMove * 64 + strongKing) * 64 + weakKing) * 64 + piece
+
+
+def pieceAttacks(pieceType, sq, occupied):
+    if pieceType == 'Q':
+        return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+    if pieceType == 'R':
+        return rookAttacks(sq, occupied)
+    return PAWN_ATTACKS['w'][sq]
+
+
+class Tablebase:
+    """One ending read from its bit-packed file through mmap, so only the pages that are probed get loaded"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] != MAGIC:
+            raise ValueError(f"{path} is not a tablebase file")
+        self.bits = self.data[4]
+        self.mask = (1 << self.bits) - 1
+
+    def get(self, i):
+        bit = i * self.bits
+        byte = HEADER_SIZE + (bit >> 3)
+        return (int.from_bytes(self.data[byte:byte + 2], "little") >> (bit & 7)) & self.mask
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def loadTables(directory=TABLEBASE_DIR):
+    """Maps every ending whose file is in directory, replacing any loaded before"""
+    for table in tables.values():
+        table.close()
+    tables.clear()
+    for ending in ENDINGS:
+        path = os.path.join(directory, ending + ".tb")
+        if os.path.exists(path):
+            tables[ending] = Tablebase(path)
+
+
+def probe(gs):
+    """Result of gs with best play as (result, plies): result 1 if white mates, -1 if black mates and 0 for a
+    draw, plies the number of plies until mate. None if gs is not one of the loaded endings."""
+    if not tables or sum(gs.pieceCounts.values()) != 3:
+        return None
+    for r, row in enumerate(gs.board):
+        for c, square in enumerate(row):
+            if square != "--" and square[1] != 'K':
+                color, pieceType, sq = square[0], square[1].upper(), r * 8 + c
+    table = tables.get("K" + pieceType + "K")
+    if table is None:
+        return None
+    if color == 'w':
+        strongKing, weakKing = gs.whiteKingLocation, gs.blackKingLocation
+        sideToMove = STRONG if gs.whiteToMove else WEAK
+        flip = 0
+    else:  # Black is the strong side, turn the board over so it plays up the board as white
+        strongKing, weakKing = gs.blackKingLocation, gs.whiteKingLocation
+        sideToMove = WEAK if gs.whiteToMove else STRONG
+        flip = 56
+    value = table.get(index(sideToMove, (strongKing[0] * 8 + strongKing[1]) ^ flip,
+                            (weakKing[0] * 8 + weakKing[1]) ^ flip, sq ^ flip))
+    if value == 0:
+        return 0, 0
+    return (1 if color == 'w' else -1), value - 1
+
+
+def bestMove(gs, validMoves):
+    """The move that keeps the tablebase result of gs: the quickest mate when winning, the longest defence when
+    losing, a drawing move in a draw. Returns (move, promotion choice, result after it as from probe), or None
+    if gs is not in the tables. Every promotion is tried, so the choice is the piece that gets that result."""
+    if probe(gs) is None:
+        return None
+    mover = 1 if gs.whiteToMove else -1
+    best, bestRank = None, None
+    for move in validMoves:
+        for choice in PROMOTION_CHOICES if move.isPawnPromotion else ('Q',):
+            gs.makeMove(move, choice)
+            outcome = probe(gs) or (0, 0)  # Taking the piece, or promoting to a piece there is no table for, draws
+            gs.undoMove()
+            result, plies = outcome
+            # Winning quickly beats any draw, which beats losing slowly
+            rank = (2, -plies) if result == mover else (1, 0) if result == 0 else (0, plies)
+            if bestRank is None or rank > bestRank:
+                best, bestRank = (move, choice, outcome), rank
+    return best
+
+
+def generate(ending, promotionTables=None):
+    """Builds the table for ending by retrograde analysis and returns its entries as a bytearray.
+    promotionTables maps "KQK" and "KRK" to their entries, needed for KPK."""
+    pieceType = ending[1]
+    values = bytearray(POSITIONS)
+    legal = bytearray(POSITIONS)
+    movesLeft = bytearray(POSITIONS)  # Weak king moves not yet known to lose
+    buckets = [[] for _ in range(256)]  # buckets[d]: positions that may be decided at d plies from mate
+
+    for strongKing in range(64):
+        for weakKing in range(64):
+            if weakKing == strongKing or KING_ATTACKS[strongKing] & SQUARE_BITS[weakKing]:
+                continue
+            for piece in range(64):
+                if piece == strongKing or piece == weakKing or (pieceType == 'P' and piece // 8 in (0, 7)):
+                    continue
+                attacks = pieceAttacks(pieceType, piece, SQUARE_BITS[strongKing])
+                inCheck = attacks & SQUARE_BITS[weakKing]
+                if not inCheck:  # With the strong side to move the weak king can't be in check
+                    legal[index(STRONG, strongKing, weakKing, piece)] = 1
+                weakIndex = index(WEAK, strongKing, weakKing, piece)
+                legal[weakIndex] = 1
+                targets = KING_ATTACKS[weakKing] & ~KING_ATTACKS[strongKing] & ~attacks & ~SQUARE_BITS[strongKing]
+                if targets & SQUARE_BITS[piece]:
+                    movesLeft[weakIndex] = CAPTURE
+                else:
+                    movesLeft[weakIndex] = bin(targets).count("1")
+                    if movesLeft[weakIndex] == 0 and inCheck:
+                        buckets[0].append(weakIndex)  # Checkmate
+
+    if pieceType == 'P':  # Promotions leave the table, their distances come from the queen and rook tables
+        for strongKing in range(64):
+            for weakKing in range(64):
+                for piece in range(8, 16):
+                    i = index(STRONG, strongKing, weakKing, piece)
+                    promotion = piece - 8
+                    if not legal[i] or promotion in (strongKing, weakKing):
+                        continue
+                    distances = [table[index(WEAK, strongKing, weakKing, promotion)] for table in promotionTables.values()]
+                    distances = [d for d in distances if d]
+                    if distances:
+                        buckets[min(distances)].append(i)  # Lost for the weak side in d - 1, so won here in d
+
+    for plies in range(len(buckets) - 1):
+        for i in buckets[plies]:
+            if values[i]:
+                continue
+            values[i] = plies + 1
+            sideToMove, rest = divmod(i, 64 * 64 * 64)
+            strongKing, rest = divmod(rest, 64 * 64)
+            weakKing, piece = divmod(rest, 64)
+            occupied = SQUARE_BITS[strongKing] | SQUARE_BITS[weakKing] | SQUARE_BITS[piece]
+            if sideToMove == WEAK:  # Lost for the weak side, every strong move leading here wins
+                for previous in squares(KING_ATTACKS[strongKing] & ~occupied):
+                    j = index(STRONG, previous, weakKing, piece)
+                    if legal[j] and not values[j]:
+                        buckets[plies + 1].append(j)
+                if pieceType == 'P':
+                    previousSquares = []
+                    if piece + 8 < 56 and not occupied & SQUARE_BITS[piece + 8]:
+                        previousSquares.append(piece + 8)
+                        if piece // 8 == 4 and not occupied & SQUARE_BITS[piece + 16]:
+                            previousSquares.append(piece + 16)
+                else:
+                    previousSquares = squares(pieceAttacks(pieceType, piece, occupied) & ~occupied)
+                for previous in previousSquares:
+                    j = index(STRONG, strongKing, weakKing, previous)
+                    if legal[j] and not values[j]:
+                        buckets[plies + 1].append(j)
+            else:  # Won for the strong side, so one more weak king move that loses
+                for previous in squares(KING_ATTACKS[weakKing] & ~occupied & ~KING_ATTACKS[strongKing]):
+                    j = index(WEAK, strongKing, previous, piece)
+                    if legal[j] and not values[j] and movesLeft[j] != CAPTURE:
+                        movesLeft[j] -= 1
+                        if movesLeft[j] == 0:  # Every move loses, the longest defence is this one
+                            buckets[plies + 1].append(j)
+    return values
+
+
+def write(path, values):
+    """Packs values with as few bits per entry as the largest one needs"""
+    bits = max(values).bit_length() or 1
+    data = bytearray((len(values) * bits + 7) // 8 + 1)  # One spare byte so every entry can be read as two bytes
+    for i, value in enumerate(values):
+        if value:
+            bit = i * bits
+            shifted = value << (bit & 7)
+            data[bit >> 3] |= shifted & 0xFF
+            data[(bit >> 3) + 1] |= shifted >> 8
+    with open(path, "wb") as f:
+        f.write(MAGIC + bytes([bits, 0, 0, 0]) + data)
+
+
+def build(directory=TABLEBASE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    built = {}
+    for ending in ENDINGS:
+        startTime = time.perf_counter()
+        promotionTables = {name: built[name] for name in ("KQK", "KRK")} if ending == "KPK" else None
+        values = generate(ending, promotionTables)
+        built[ending] = values
+        path = os.path.join(directory, ending + ".tb")
+        write(path, values)
+        longest = max(values) - 1
+        wins = sum(1 for i in range(POSITIONS // 2) if values[i])
+        print(f"{ending}: {wins} won positions with the strong side to move, longest mate {longest} plies, "
+              f"{os.path.getsize(path)} bytes, {time.perf_counter() - startTime:.1f}s")
+    loadTables(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the KQK, KRK and KPK endgame tablebases")
+    parser.add_argument("--dir", default=TABLEBASE_DIR, help="directory to write the .tb files to")
+    args = parser.parse_args(argv)
+    build(args.dir)
+    return 0
+
+
+loadTables()
+
+if __name__ == "__main__":
+    sys.exit(main())
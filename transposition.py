@@ -0,0 +1,57 @@
+import sys
+
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2
+# Rough size of one stored entry: the tuple itself, its 64-bit key, score and move ID, plus the list slot
+ENTRY_BYTES = sys.getsizeof((0, 0, 0, 0, 0, 0)) + sys.getsizeof(1 << 63) + 2 * sys.getsizeof(10 ** 4) + 8
+
+
+class TranspositionTable:
+    """Fixed-size table of search results indexed by GameState.zobristKey.
+
+    Each slot holds one (key, depth, score, flag, moveID, generation) tuple. A new result replaces the stored one
+    if it is for the same position, was searched at least as deep, or the stored one is left over from an earlier
+    search. The slot count is the largest power of two that fits in sizeMB, so it never grows.
+    """
+
+    def __init__(self, sizeMB=16):
+        slots = max(1, sizeMB * 1024 * 1024 // ENTRY_BYTES)
+        self.size = 1 << (slots.bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.hits, self.misses, self.stores, self.overwrites = 0, 0, 0, 0
+
+    def newSearch(self):
+        """Ages every stored entry so the next search may replace them freely"""
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.hits, self.misses, self.stores, self.overwrites = 0, 0, 0, 0
+
+    def probe(self, key):
+        """Returns (depth, score, flag, moveID) for the position, or None if it is not stored"""
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1], entry[2], entry[3], entry[4]
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, flag, moveID):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is not None:
+            if entry[0] != key and entry[5] == self.generation and entry[1] > depth:
+                return  # Keep the deeper result from this search
+            if entry[0] != key:
+                self.overwrites += 1
+        self.stores += 1
+        self.entries[index] = (key, depth, score, flag, moveID, self.generation)
+
+    def stats(self):
+        probes = self.hits + self.misses
+        used = sum(1 for entry in self.entries if entry is not None)
+        return {"size": self.size, "used": used, "hits": self.hits, "misses": self.misses,
+                "hitRate": self.hits / probes if probes else 0.0, "stores": self.stores,
+                "overwrites": self.overwrites}
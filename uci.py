@@ -0,0 +1,209 @@
+import copy
+import sys
+import threading
+import time
+import computer
+from computer import CHECKMATE
+from transposition import TranspositionTable
+from perft import START_FEN, newGameState
+
+ENGINE_NAME = "PyChessGame"
+ENGINE_AUTHOR = "ElDEEB21"
+USE_BITBOARDS = True
+MAX_DEPTH = 64  # Depth searched by "go" without a depth, until it is stopped or its time or nodes run out
+MOVES_TO_GO = 30  # Moves the remaining clock time is shared out over when "go" doesn't give movestogo
+MOVE_OVERHEAD = 50  # Milliseconds kept back on the clock for the engine and GUI to pass the move along
+GO_LIMITS = ("depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo")
+PROMOTION_CHOICES = {'q': 'Q', 'r': 'R', 'b': 'B', 'n': 'N'}
+
+
+def moveToUci(move, choice='Q'):
+    """Long algebraic notation as UCI writes it, e.g. e2e4 or e7e8q"""
+    return move.getChessNotation() + (choice.lower() if move.isPawnPromotion else '')
+
+
+def parseMove(gs, text):
+    """(move, promotion choice) for a UCI move in gs, or (None, None) if it is not legal there"""
+    notation, choice = text[:4], PROMOTION_CHOICES.get(text[4:5], 'Q')
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move, choice
+    return None, None
+
+
+def clockTime(remaining, increment, movesToGo):
+    """Seconds to search a move for, with remaining and increment milliseconds on the mover's clock"""
+    budget = remaining / max(movesToGo, 1) + increment * 3 / 4
+    return max(min(budget, max(remaining - MOVE_OVERHEAD, remaining / 4)), 1) / 1000  # A quarter of a short clock
+
+
+def formatScore(score, pv, whiteToMove):
+    """UCI score of a SearchResult score (pawns from white's point of view): centipawns or moves to mate,
+    both from the side to move's point of view"""
+    score = score if whiteToMove else -score
+    if abs(score) >= CHECKMATE:
+        moves = (len(pv) + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {round(score * 100)}"
+
+
+class UciEngine:
+    """Reads UCI commands on the main thread and searches in a background thread, so "stop", "isready" and
+    "quit" are answered while a search is running. Every "go" runs a new computer.Search on the engine's own
+    transposition table, which "ucinewgame" clears. After "go infinite" or "go ponder" the bestmove is held back
+    until "stop" (or "ponderhit", after which the search runs on the clock), even if the search ends first."""
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()  # The search thread writes info lines while commands are answered
+        self.transpositionTable = TranspositionTable(computer.TT_SIZE_MB)
+        self.gs = newGameState(START_FEN, USE_BITBOARDS)
+        self.thread = None
+        self.activeSearch = None
+        self.release = threading.Event()  # Set once the running search may send its bestmove
+        self.ponderTime = None  # Time limit of a "go ponder" search, started on "ponderhit"
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def loop(self, lines=None):
+        """Answers commands from lines (stdin by default) until "quit" or the end of input"""
+        for line in lines if lines is not None else sys.stdin:
+            if not self.handle(line):
+                break
+        self.stop()
+
+    def handle(self, line):
+        """Runs one command, returns False on "quit" """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            self.transpositionTable.clear()
+        elif command == "position":
+            self.stop()
+            self.setPosition(args)
+        elif command == "go":
+            self.stop()
+            self.go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderHit()
+        elif command == "quit":
+            return False
+        return True
+
+    def setPosition(self, args):
+        """position startpos|fen <fen> [moves <move> ...]; stops at the first move that is not legal"""
+        movesAt = args.index("moves") if "moves" in args else len(args)
+        if args and args[0] == "fen":
+            fen = " ".join(args[1:movesAt])
+        else:
+            fen = START_FEN
+        try:
+            gs = newGameState(fen, USE_BITBOARDS)
+            gs.getValidMoves()  # Positions the move generators can't handle are refused here, not mid-search
+        except (ValueError, KeyError, IndexError):
+            self.send(f"info string invalid fen {fen}")
+            return
+        self.gs = gs
+        for text in args[movesAt + 1:]:
+            move, choice = parseMove(self.gs, text)
+            if move is None:
+                self.send(f"info string illegal move {text}")
+                return
+            self.gs.makeMove(move, choice)
+
+    def go(self, args):
+        """go [depth <plies>] [movetime <ms>] [nodes <count>] [wtime <ms>] [btime <ms>] [winc <ms>] [binc <ms>]
+        [movestogo <moves>] [infinite] [ponder]. Without movetime the time limit comes from the mover's clock."""
+        limits = {}
+        for name in GO_LIMITS:
+            if name in args:
+                try:
+                    limits[name] = int(args[args.index(name) + 1])
+                except (IndexError, ValueError):
+                    pass
+        depth = limits.get("depth", MAX_DEPTH)
+        clock, increment = ("wtime", "winc") if self.gs.whiteToMove else ("btime", "binc")
+        if "movetime" in limits:
+            timeLimit = limits["movetime"] / 1000
+        elif clock in limits:
+            timeLimit = clockTime(limits[clock], limits.get(increment, 0), limits.get("movestogo", MOVES_TO_GO))
+        else:
+            timeLimit = None
+        self.ponderTime = None
+        if "infinite" in args or "ponder" in args:
+            self.release.clear()
+            if "ponder" in args:
+                self.ponderTime, timeLimit = timeLimit, None
+            if "infinite" in args:
+                timeLimit = None
+        else:
+            self.release.set()
+        gs = copy.deepcopy(self.gs)  # "position" may replace self.gs while this searches
+        search = computer.Search(self.transpositionTable)
+        search.onIteration = lambda result: self.sendInfo(result, gs.whiteToMove)
+        self.activeSearch = search
+        self.thread = threading.Thread(target=self.run, args=(search, gs, depth, timeLimit, limits.get("nodes")),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, search, gs, depth, timeLimit, nodeLimit):
+        validMoves = gs.getValidMoves()
+        if not validMoves:
+            self.release.wait()
+            self.send("bestmove 0000")
+            return
+        try:
+            result = search.run(gs, validMoves, depth, timeLimit, nodeLimit)
+        except (KeyError, IndexError) as error:  # A position the move generators can't handle further down
+            self.send(f"info string search failed: {error!r}")
+            self.release.wait()
+            self.send("bestmove 0000")
+            return
+        bestMove = result.bestMove if result.bestMove is not None else validMoves[0]  # Stopped during depth 1
+        self.release.wait()  # An infinite or ponder search waits for "stop" or "ponderhit"
+        self.send(f"bestmove {moveToUci(bestMove, result.choice)}")
+
+    def sendInfo(self, result, whiteToMove):
+        nps = int(result.nodes / result.time) if result.time > 0 else 0
+        pv = " ".join(moveToUci(move, result.choice if i == 0 else 'Q') for i, move in enumerate(result.pv))
+        self.send(f"info depth {result.depth} score {formatScore(result.score, result.pv, whiteToMove)} "
+                  f"nodes {result.nodes} nps {nps} time {int(result.time * 1000)} pv {pv}")
+
+    def ponderHit(self):
+        """The opponent played the expected move: the ponder search goes on as a normal one, on the clock"""
+        if self.thread is None or self.release.is_set():
+            return
+        if self.ponderTime is not None:
+            self.activeSearch.deadline = time.perf_counter() + self.ponderTime
+        self.release.set()
+
+    def stop(self):
+        """Stops the running search, if any; its bestmove is sent before this returns"""
+        if self.thread is not None:
+            self.activeSearch.stop()
+            self.release.set()
+            self.thread.join()
+        self.thread, self.activeSearch = None, None
+
+
+def main():
+    UciEngine().loop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
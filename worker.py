@@ -0,0 +1,91 @@
+import copy
+import threading
+import time
+import computer
+import parallel
+
+
+class SearchWorker:
+    """Runs the AI search in a background thread on a copy of the game, so the GUI keeps drawing while it thinks.
+
+    Call search() every frame while it is the AI's turn, and play the move once finished() is True. After the AI
+    has moved, ponder() searches the position after the reply it expects. If the opponent plays that reply,
+    search() carries on with the pondering search, or takes its result at once if it has already finished.
+    """
+
+    def __init__(self):
+        self.thread = None
+        self.activeSearch = None  # The computer.Search (or parallel.ParallelSearch) the thread is running
+        self.rootKey = None  # zobristKey of the position being searched
+        self.pondering = False
+        self.expectedMove = None  # The opponent's reply a pondering search assumes
+        self.result = None
+        self.done = False
+        # From the principal variation of the last search: the reply it expects and the key of the position
+        # that reply would be played in
+        self.replyKey, self.expectedReply = None, None
+
+    def search(self, gs, depth, timeLimit=None, workers=1):
+        """Starts searching gs, unless a search or a pondering search of the same position is already running"""
+        if self.thread is not None and self.rootKey == gs.zobristKey:
+            if self.pondering:  # Ponder hit, the expected reply was played
+                self.pondering = False
+                if not self.done and timeLimit is not None:
+                    self.activeSearch.deadline = time.perf_counter() + timeLimit  # From now on it is on the clock
+            return
+        self.cancel()
+        self.start(gs, depth, timeLimit, workers)
+
+    def ponder(self, gs, validMoves, depth):
+        """While the opponent thinks, searches the position after the reply the last search expected from them"""
+        self.cancel()
+        if gs.zobristKey != self.replyKey:
+            return  # Not the position the last search ended in, e.g. after an undo
+        for move in validMoves:
+            if move == self.expectedReply:
+                expected = copy.deepcopy(gs)
+                expected.makeMove(move)
+                self.start(expected, depth, None, 1)  # No time limit until the opponent actually replies
+                self.pondering, self.expectedMove = True, move
+                return
+
+    def start(self, gs, depth, timeLimit, workers):
+        self.rootKey = gs.zobristKey
+        self.pondering, self.result, self.done = False, None, False
+        if workers > 1:
+            self.activeSearch = parallel.ParallelSearch(workers)
+        else:
+            self.activeSearch = computer.Search(computer.transpositionTable)
+        self.thread = threading.Thread(target=self.run, args=(self.activeSearch, copy.deepcopy(gs), depth, timeLimit),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, search, gs, depth, timeLimit):
+        validMoves = gs.getValidMoves()
+        result = search.run(gs, validMoves, depth, timeLimit) if validMoves else computer.SearchResult()
+        if len(result.pv) >= 2:
+            gs.makeMove(result.pv[0], result.choice)
+            self.replyKey, self.expectedReply = gs.zobristKey, result.pv[1]
+            gs.undoMove()
+        else:
+            self.replyKey, self.expectedReply = None, None
+        self.result = result
+        self.done = True
+
+    def finished(self, gs):
+        """True once the search of gs (not a pondering search) has a result"""
+        return self.thread is not None and not self.pondering and self.done and self.rootKey == gs.zobristKey
+
+    def takeResult(self):
+        """The finished search's computer.SearchResult. Its moves belong to the searched copy of the game"""
+        result = self.result
+        self.thread, self.activeSearch, self.rootKey, self.result, self.done = None, None, None, None, False
+        return result
+
+    def cancel(self):
+        """Stops the running search, if any, and throws its result away"""
+        if self.thread is not None:
+            self.activeSearch.stop()
+            self.thread.join()
+        self.thread, self.activeSearch, self.rootKey, self.result, self.done = None, None, None, None, False
+        self.pondering, self.expectedMove = False, None